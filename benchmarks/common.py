@@ -0,0 +1,34 @@
+"""
+What the benchmarks share: where results go, how a stage is timed and which commit was measured.
+"""
+
+import os
+import statistics
+import subprocess
+import time
+
+RESULTS_DIR = os.path.join(os.getcwd(), "cache/benchmarks")
+
+
+def timed(fn, runs):
+    """Median seconds of fn over runs, and what it returned the last time"""
+    times = []
+    for _ in range(runs):
+        # the last run's result is freed first, it would only crowd the next one
+        result = None
+        start = time.perf_counter()
+        result = fn()
+        times.append(time.perf_counter() - start)
+    return statistics.median(times), result
+
+
+def current_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
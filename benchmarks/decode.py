@@ -0,0 +1,72 @@
+"""
+Decode throughput of a think call with and without prompt-lookup drafting.
+
+    python -m benchmarks.decode [--model NAME_OR_PATH] [--runs N] [--lookup N]
+"""
+
+import argparse
+import time
+
+from rich.console import Console
+from rich.table import Table
+
+from src.ai import generate_code
+from src.ai.model import brain
+from src.ai.stats import decode_stats
+
+console = Console()
+
+PROMPTS = [
+    "print the variable 'c' to the console",
+    "write a for loop from 0 to 10 that prints every even number",
+    "write a function that returns the factorial of a number",
+]
+
+
+def tokens_per_second(prompt, runs):
+    """Best of `runs` generations, and the tokens each of them produced"""
+    best = None
+    for _ in range(runs):
+        start = time.perf_counter()
+        generate_code.generate_respose(prompt)
+        elapsed = time.perf_counter() - start
+        steps = decode_stats.calls[-1]["steps"]
+        if best is None or steps / elapsed > best[0]:
+            best = (steps / elapsed, steps)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--model", default=brain.name)
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument(
+        "--lookup", type=int, default=10, help="tokens drafted per step when on"
+    )
+    args = parser.parse_args()
+
+    brain.name = args.model
+    brain.load()
+    # warm up the preamble cache so neither side pays for its prefill
+    generate_code.prompt_lookup_tokens = 0
+    generate_code.generate_respose(PROMPTS[0])
+
+    table = Table(title=f"Decode, prompt lookup of {args.lookup} tokens")
+    table.add_column("prompt")
+    table.add_column("tokens", justify="right")
+    table.add_column("off (tok/s)", justify="right")
+    table.add_column("on (tok/s)", justify="right")
+    table.add_column("speedup", justify="right")
+
+    for prompt in PROMPTS:
+        generate_code.prompt_lookup_tokens = 0
+        off, steps = tokens_per_second(prompt, args.runs)
+        generate_code.prompt_lookup_tokens = args.lookup
+        on, _ = tokens_per_second(prompt, args.runs)
+        table.add_row(prompt, str(steps), f"{off:.1f}", f"{on:.1f}", f"{on / off:.2f}x")
+
+    console.print(table)
+
+
+if __name__ == "__main__":
+    main()
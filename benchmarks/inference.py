@@ -0,0 +1,96 @@
+"""
+Load time and decode throughput of the model for every inference config.
+
+    python -m benchmarks.inference [--model NAME_OR_PATH] [--tokens N] [--threads N ...] [--compile]
+"""
+
+import argparse
+import time
+
+from rich.console import Console
+from rich.table import Table
+
+from src.ai.model import LazyModel, brain
+from src.ai.inference import InferenceConfig
+from src.ai.prompt import prompt_context
+
+console = Console()
+
+PROMPT = "write a function that returns the factorial of a number"
+
+
+def configs(threads, compile):
+    for count in threads:
+        yield InferenceConfig("fp32", threads=count)
+        yield InferenceConfig("bf16", threads=count)
+        yield InferenceConfig("fp32", quantize=True, threads=count)
+        if compile:
+            yield InferenceConfig("fp32", threads=count, compile=True)
+            yield InferenceConfig("bf16", threads=count, compile=True)
+
+
+def measure(name, config, tokens):
+    import torch
+
+    holder = LazyModel(name, config=config)
+    start = time.perf_counter()
+    tokenizer, model = holder.load()
+    load_time = time.perf_counter() - start
+
+    inputs = torch.tensor([prompt_context.encode(tokenizer, PROMPT)])
+    settings = {
+        "do_sample": False,
+        "eos_token_id": None,
+        "pad_token_id": tokenizer.eos_token_id,
+    }
+    # the first call pays for compilation and allocator warm up
+    model.generate(inputs, max_new_tokens=2, min_new_tokens=2, **settings)
+
+    start = time.perf_counter()
+    outputs = model.generate(
+        inputs, max_new_tokens=tokens, min_new_tokens=tokens, **settings
+    )
+    decode_time = time.perf_counter() - start
+    generated = outputs.shape[1] - inputs.shape[1]
+    return load_time, generated / decode_time
+
+
+def main():
+    import torch
+
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--model", default=brain.name)
+    parser.add_argument("--tokens", type=int, default=64)
+    parser.add_argument(
+        "--threads", type=int, nargs="+", default=[torch.get_num_threads()]
+    )
+    parser.add_argument(
+        "--compile", action="store_true", help="also measure torch.compile"
+    )
+    args = parser.parse_args()
+
+    table = Table(title=f"Inference, {args.tokens} generated tokens")
+    table.add_column("dtype")
+    table.add_column("threads", justify="right")
+    table.add_column("compiled")
+    table.add_column("load (s)", justify="right")
+    table.add_column("decode (tok/s)", justify="right")
+
+    # one untimed load, so the first row is not charged for importing the model code
+    LazyModel(args.model, config=InferenceConfig("fp32")).load()
+
+    for config in configs(args.threads, args.compile):
+        load_time, speed = measure(args.model, config, args.tokens)
+        table.add_row(
+            config.describe(),
+            str(config.threads),
+            "yes" if config.compile else "no",
+            f"{load_time:.2f}",
+            f"{speed:.1f}",
+        )
+
+    console.print(table)
+
+
+if __name__ == "__main__":
+    main()
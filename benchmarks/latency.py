@@ -0,0 +1,238 @@
+"""
+Where the time of a think call goes, stage by stage, for the model and the fake backend.
+
+    python -m benchmarks.latency [--model NAME_OR_PATH] [--backend all|transformers|fake]
+                                 [--runs N] [--tokens N] [--fake-delay S]
+                                 [--output FILE] [--compare FILE]
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import time
+
+from rich.console import Console
+from rich.table import Table
+
+from benchmarks.common import RESULTS_DIR, current_commit, timed
+from src.ai import generate_code
+from src.ai.backends import FakeBackend, TransformersBackend
+from src.ai.model import brain
+from src.ai.prompt import prompt_context
+from src.ai.prefix_cache import PrefixCache
+from src.lib.lex import Lexer
+from src.lib.parser import Parser
+from src.interpreter import (
+    Interpreter,
+    Context,
+    global_symbol_table,
+    private_symbol_table,
+    run,
+)
+
+console = Console()
+
+PROMPT = "write a for loop from 0 to 10 that prints every even number"
+# what a good answer to PROMPT looks like, so the fake backend runs real code
+SAMPLE_CODE = """for i = 0 to 10 do
+	if i % 2 == 0 then
+		print(i)
+	end
+end
+"""
+
+
+def quietly(fn):
+    with contextlib.redirect_stdout(io.StringIO()):
+        return fn()
+
+
+def code_stages(code, runs):
+    """Lexing, parsing and running generated code, None for stages it never reaches"""
+    stages = {"lex": None, "parse": None, "exec": None}
+
+    stages["lex"], (tokens, error) = timed(
+        lambda: Lexer("<think>", code).make_tokens(), runs
+    )
+    if error:
+        return stages
+
+    stages["parse"], ast = timed(lambda: Parser(tokens).parse(), runs)
+    if ast.error:
+        return stages
+
+    def execute():
+        context = Context("<think>")
+        context.symbol_table = global_symbol_table
+        context.private_symbol_table = private_symbol_table
+        return Interpreter().visit_statements(ast.node, context)
+
+    stages["exec"], _ = timed(lambda: quietly(execute), runs)
+    return stages
+
+
+def fake_stages(runs, delay):
+    generate_code.backends = [FakeBackend(delay, {PROMPT: SAMPLE_CODE})]
+    stages = {}
+
+    stages["gather_prompt"], _ = timed(
+        lambda: generate_code.gather_prompt(PROMPT), runs
+    )
+    response = f"```\n{SAMPLE_CODE}```"
+    stages["clean_response"], code = timed(
+        lambda: generate_code.clean_response(response), runs
+    )
+    stages.update(code_stages(code, runs))
+
+    # a whole think statement, everything the interpreter adds around the backend
+    think, (_, error) = timed(
+        lambda: quietly(lambda: run("<bench>", f'think "{PROMPT}"')), runs
+    )
+    if error:
+        console.print(error, style="bold red")
+    stages["think_overhead"] = think - delay
+    return stages
+
+
+def transformers_stages(runs, tokens):
+    import torch
+
+    generate_code.backends = [TransformersBackend()]
+    stages = {}
+
+    stages["load"], (tokenizer, model) = timed(brain.load, 1)
+    stages["gather_prompt"], _ = timed(
+        lambda: generate_code.gather_prompt(PROMPT), runs
+    )
+
+    def tokenize_cold():
+        prompt_context.prefix_ids = None
+        return prompt_context.encode(tokenizer, PROMPT)
+
+    stages["tokenize_preamble"], _ = timed(tokenize_cold, runs)
+    stages["tokenize"], ids = timed(
+        lambda: prompt_context.encode(tokenizer, PROMPT), runs
+    )
+    prefix_ids = prompt_context.tokenize_prefix(tokenizer)
+    inputs = torch.tensor([ids], device=model.device)
+
+    with torch.no_grad():
+        stages["prefill"], _ = timed(lambda: model(inputs, use_cache=True), runs)
+
+        cache = PrefixCache()
+        cache.get(brain.name, brain.revision, model, prefix_ids)
+
+        def prefill_cached():
+            with cache.borrow(
+                brain.name, brain.revision, model, prefix_ids
+            ) as past_key_values:
+                model(
+                    inputs[:, len(prefix_ids) :],
+                    past_key_values=past_key_values,
+                    use_cache=True,
+                )
+
+        stages["prefill_cached"], _ = timed(prefill_cached, runs)
+
+    settings = {
+        "do_sample": False,
+        "eos_token_id": None,
+        "pad_token_id": generate_code.pad_token_of(tokenizer),
+    }
+    # the difference between generating one and many tokens leaves out the prefill
+    one, _ = timed(
+        lambda: model.generate(inputs, max_new_tokens=1, min_new_tokens=1, **settings),
+        runs,
+    )
+    many, _ = timed(
+        lambda: model.generate(
+            inputs, max_new_tokens=tokens, min_new_tokens=tokens, **settings
+        ),
+        runs,
+    )
+    stages["decode_per_token"] = (many - one) / (tokens - 1)
+
+    stages["generate"], response = timed(
+        lambda: generate_code.generate_respose(PROMPT), 1
+    )
+    stages["clean_response"], code = timed(
+        lambda: generate_code.clean_response(response), runs
+    )
+    stages.update(code_stages(code, runs))
+    return stages
+
+
+def milliseconds(seconds):
+    return "-" if seconds is None else f"{seconds * 1000:.3f}"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--model", default=brain.name)
+    parser.add_argument(
+        "--backend", choices=("all", "transformers", "fake"), default="all"
+    )
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--tokens", type=int, default=32)
+    parser.add_argument("--fake-delay", type=float, default=0.0)
+    parser.add_argument(
+        "--output", help="defaults to cache/benchmarks/latency-<commit>.json"
+    )
+    parser.add_argument("--compare", help="results of an earlier run to compare with")
+    args = parser.parse_args()
+
+    brain.name = args.model
+    commit = current_commit()
+    results = {
+        "commit": commit,
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "machine": platform.platform(),
+        "processor": platform.processor(),
+        "model": args.model,
+        "runs": args.runs,
+        "backends": {},
+    }
+
+    if args.backend in ("all", "fake"):
+        results["backends"]["fake"] = fake_stages(args.runs, args.fake_delay)
+    if args.backend in ("all", "transformers"):
+        results["backends"]["transformers"] = transformers_stages(
+            args.runs, args.tokens
+        )
+
+    baseline = {}
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)["backends"]
+
+    for backend, stages in results["backends"].items():
+        table = Table(title=f"Think latency, {backend} backend")
+        table.add_column("stage")
+        table.add_column("ms", justify="right")
+        if args.compare:
+            table.add_column("before (ms)", justify="right")
+            table.add_column("change", justify="right")
+
+        for stage, seconds in stages.items():
+            row = [stage, milliseconds(seconds)]
+            if args.compare:
+                before = baseline.get(backend, {}).get(stage)
+                row.append(milliseconds(before))
+                row.append(f"{seconds / before:.2f}x" if seconds and before else "-")
+            table.add_row(*row)
+        console.print(table)
+
+    output = args.output or os.path.join(
+        RESULTS_DIR, f"latency-{commit or 'local'}.json"
+    )
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w") as f:
+        json.dump(results, f, indent=2)
+    console.print(f"Wrote {output}", style="green")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,118 @@
+"""
+Lexing speed on multi-MB ThinkLang sources built from the example scripts.
+
+    python -m benchmarks.lexer [--size MB] [--runs N] [--output FILE] [--compare FILE]
+"""
+
+import argparse
+import glob
+import json
+import os
+import time
+
+from rich.console import Console
+from rich.table import Table
+
+from benchmarks.common import RESULTS_DIR, current_commit, timed
+from src.lib.lex import Lexer
+
+console = Console()
+
+SOURCES = ["examples/*.think", "test.think"]
+
+
+def example_source():
+    parts = []
+    for pattern in SOURCES:
+        for path in sorted(glob.glob(pattern)):
+            with open(path) as f:
+                parts.append(f.read().rstrip("\n") + "\n")
+    return "".join(parts)
+
+
+def source_of_size(megabytes):
+    """The example scripts repeated until they are about this many megabytes"""
+    example = example_source()
+    copies = max(1, round(megabytes * 1024 * 1024 / len(example)))
+    return example * copies
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--size", type=float, default=4.0, help="megabytes of source")
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument(
+        "--output", help="defaults to cache/benchmarks/lexer-<commit>.json"
+    )
+    parser.add_argument("--compare", help="results of an earlier run to compare with")
+    args = parser.parse_args()
+
+    text = source_of_size(args.size)
+    seconds, (tokens, error) = timed(
+        lambda: Lexer("<bench>", text).make_tokens(), args.runs
+    )
+    if error:
+        console.print(str(error), style="bold red")
+        return
+    # how the parser reads them, each token dropped once it has been looked at
+    stream_seconds, _ = timed(
+        lambda: sum(1 for _ in Lexer("<bench>", text).generate_tokens()), args.runs
+    )
+
+    commit = current_commit()
+    results = {
+        "commit": commit,
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "bytes": len(text),
+        "tokens": len(tokens),
+        "seconds": seconds,
+        "mb_per_second": len(text) / seconds / 1024 / 1024,
+        "tokens_per_second": len(tokens) / seconds,
+        "stream_seconds": stream_seconds,
+        "stream_mb_per_second": len(text) / stream_seconds / 1024 / 1024,
+    }
+
+    table = Table(
+        title=f"Lexing {len(text) / 1024 / 1024:.1f} MB, {len(tokens)} tokens"
+    )
+    table.add_column("metric")
+    table.add_column("value", justify="right")
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        table.add_column("before", justify="right")
+        table.add_column("speedup", justify="right")
+
+    for metric in (
+        "seconds",
+        "mb_per_second",
+        "tokens_per_second",
+        "stream_seconds",
+        "stream_mb_per_second",
+    ):
+        row = [metric, f"{results[metric]:.3f}"]
+        if args.compare:
+            # runs from before streaming was measured only have the list numbers
+            before = baseline.get(metric)
+            if before is None:
+                row += ["-", "-"]
+            else:
+                row.append(f"{before:.3f}")
+                faster = (
+                    before / results[metric]
+                    if metric.endswith("seconds")
+                    else results[metric] / before
+                )
+                row.append(f"{faster:.1f}x")
+        table.add_row(*row)
+    console.print(table)
+
+    output = args.output or os.path.join(RESULTS_DIR, f"lexer-{commit or 'local'}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w") as f:
+        json.dump(results, f, indent=2)
+    console.print(f"Wrote {output}", style="green")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,128 @@
+"""
+Checks that the lexer makes the same tokens and errors as the char by char one it replaced.
+
+    python -m benchmarks.lexer_equivalence [--rev REV] [--cases N] [--seed N]
+"""
+
+import argparse
+import glob
+import importlib
+import io
+import os
+import random
+import subprocess
+import sys
+import tarfile
+import tempfile
+
+from rich.console import Console
+
+from src.lib.lex import Lexer
+from src.lib.utils import source_buffer
+
+console = Console()
+
+# the last commit with the char by char lexer
+BEFORE = "250547f^"
+PIECES = list("ab_x9 0.=+!-><\"'\\\n;#\t,()[]^*/%") + [
+    "var",
+    "if",
+    " then ",
+    "end",
+    " = ",
+    "+=",
+    "==",
+    "x =",
+    "func f(",
+    "é",
+    "\r",
+    "1.2.3",
+    "while ",
+    "for i = 0 to 3 then\n",
+]
+
+
+def lexer_at(rev, directory):
+    """The Lexer class of src at rev, unpacked into directory as the package `before`"""
+    archive = subprocess.run(
+        ["git", "archive", rev, "src"], capture_output=True, check=True
+    ).stdout
+    with tarfile.open(fileobj=io.BytesIO(archive)) as tar:
+        tar.extractall(directory)
+    os.rename(os.path.join(directory, "src"), os.path.join(directory, "before"))
+    sys.path.insert(0, directory)
+    return importlib.import_module("before.lib.lex").Lexer
+
+
+def old_position(pos, end=False):
+    return pos.ln, pos.col
+
+
+def new_position(offset, end=False):
+    pos = source_buffer.position(offset, end)
+    return pos.ln, pos.col
+
+
+def lexed(lexer_class, position, text):
+    tokens, error = lexer_class("<fuzz>", text).make_tokens()
+    if error:
+        return error.error_name, error.details, position(error.pos_start), str(error)
+    return [
+        (t.type, t.value, position(t.pos_start), position(t.pos_end, True))
+        for t in tokens
+    ]
+
+
+def differs(old, new):
+    if old == new:
+        return False
+    # an error at a '!' that ends its line used to underline the next line too,
+    # so only where it is and what it says have to match there
+    if isinstance(old, tuple) and isinstance(new, tuple) and "(after '!')" in new[1]:
+        return old[:3] != new[:3]
+    return True
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument(
+        "--rev", default=BEFORE, help="commit of the lexer to compare with"
+    )
+    parser.add_argument("--cases", type=int, default=100000, help="random texts to lex")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        OldLexer = lexer_at(args.rev, directory)
+
+        texts = []
+        for path in sorted(glob.glob("**/*.think", recursive=True)):
+            with open(path) as f:
+                texts.append(f.read())
+        scripts = len(texts)
+        rng = random.Random(args.seed)
+        for _ in range(args.cases):
+            texts.append("".join(rng.choice(PIECES) for _ in range(rng.randint(0, 25))))
+
+        mismatches = 0
+        for text in texts:
+            old = lexed(OldLexer, old_position, text)
+            new = lexed(Lexer, new_position, text)
+            if differs(old, new):
+                mismatches += 1
+                if mismatches <= 3:
+                    console.print(repr(text), style="bold")
+                    console.print(f"before: {old}")
+                    console.print(f"now:    {new}")
+
+    style = "bold red" if mismatches else "green"
+    console.print(
+        f"{mismatches} of {len(texts)} texts lexed differently "
+        f"({scripts} scripts, {args.cases} random)",
+        style=style,
+    )
+    sys.exit(1 if mismatches else 0)
+
+
+if __name__ == "__main__":
+    main()
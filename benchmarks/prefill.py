@@ -0,0 +1,83 @@
+"""
+Prefill cost of a think call with and without the cached syntax preamble.
+
+    python -m benchmarks.prefill [--model NAME_OR_PATH] [--runs N]
+"""
+
+import argparse
+import time
+
+from rich.console import Console
+from rich.table import Table
+
+from src.ai.model import brain
+from src.ai.prompt import prompt_context
+from src.ai.prefix_cache import PrefixCache
+
+console = Console()
+
+PROMPTS = [
+    "print the variable 'c' to the console",
+    "subtract 'a' with 'b' and print the result",
+    "write a function that returns the factorial of a number",
+]
+
+
+def timed(fn):
+    start = time.perf_counter()
+    fn()
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--model", default=brain.name)
+    parser.add_argument("--runs", type=int, default=3)
+    args = parser.parse_args()
+
+    import torch
+
+    brain.name = args.model
+    tokenizer, model = brain.load()
+    prefix_ids = prompt_context.tokenize_prefix(tokenizer)
+    cache = PrefixCache()
+
+    build_time = timed(lambda: cache.get(brain.name, brain.revision, model, prefix_ids))
+
+    table = Table(title=f"Prefill, preamble of {len(prefix_ids)} tokens")
+    table.add_column("prompt")
+    table.add_column("tokens", justify="right")
+    table.add_column("full prefill (s)", justify="right")
+    table.add_column("cached prefix (s)", justify="right")
+    table.add_column("speedup", justify="right")
+
+    with torch.no_grad():
+        for prompt in PROMPTS:
+            ids = torch.tensor([prompt_context.encode(tokenizer, prompt)])
+            suffix = ids[:, len(prefix_ids) :]
+
+            full = min(
+                timed(lambda: model(ids, use_cache=True)) for _ in range(args.runs)
+            )
+
+            def cached_prefill():
+                with cache.borrow(
+                    brain.name, brain.revision, model, prefix_ids
+                ) as past_key_values:
+                    model(suffix, past_key_values=past_key_values, use_cache=True)
+
+            cached = min(timed(cached_prefill) for _ in range(args.runs))
+            table.add_row(
+                prompt,
+                str(ids.shape[1]),
+                f"{full:.4f}",
+                f"{cached:.4f}",
+                f"{full / cached:.1f}x",
+            )
+
+    console.print(table)
+    console.print(f"One-off preamble prefill: {build_time:.4f}s")
+
+
+if __name__ == "__main__":
+    main()
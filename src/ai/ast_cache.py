@@ -0,0 +1,63 @@
+#######################################
+# THINK AST CACHE
+#######################################
+
+import threading
+from collections import OrderedDict
+
+from ..lib.lex import Lexer
+from ..lib.parser import Parser
+
+THINK_FN = "<think>"
+AST_CACHE_MAX_ENTRIES = 256
+
+
+class ThinkASTCache:
+    """
+    Generated code lexed and parsed once per process, keyed by its text. A think
+    inside a loop gets the same code every iteration, so after the first one only
+    evaluating the cached AST is left. Code that fails to lex or parse keeps its
+    error instead. Generated code is validated on the pipeline and async threads
+    too, so the entries are only touched under a lock
+    """
+
+    __slots__ = ("entries", "max_entries", "hits", "misses", "lock")
+
+    def __init__(self, max_entries=AST_CACHE_MAX_ENTRIES):
+        self.entries = OrderedDict()
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def compile(self, code):
+        """The statements of the code and None, or None and its lex or parse error"""
+        with self.lock:
+            entry = self.entries.get(code)
+            if entry is not None:
+                self.hits += 1
+                self.entries.move_to_end(code)
+                return entry
+            self.misses += 1
+
+        # parsed outside the lock, two threads at most parse the same code twice
+        lexer = Lexer(THINK_FN, code)
+        ast = Parser(lexer.generate_tokens()).parse()
+        if lexer.error:
+            entry = (None, lexer.error)
+        else:
+            entry = (None, ast.error) if ast.error else (ast.node, None)
+
+        with self.lock:
+            self.entries[code] = entry
+            self.entries.move_to_end(code)
+            if len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+        return entry
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+
+think_asts = ThinkASTCache()
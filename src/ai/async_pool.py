@@ -0,0 +1,57 @@
+#######################################
+# ASYNC THINK POOL
+#######################################
+
+import queue
+import threading
+from concurrent.futures import Future
+
+# thinks started with think_async that may be generating at the same time
+ASYNC_WORKERS = 4
+
+
+class ThinkPool:
+    """
+    The bounded set of threads think_async hands its prompts to. The script keeps
+    running while they generate, and await_think blocks on the returned future.
+    The threads are daemons like the pipeline's, so exiting never waits on a
+    think nobody awaited
+    """
+
+    __slots__ = ("max_workers", "queue", "workers", "lock")
+
+    def __init__(self, max_workers=ASYNC_WORKERS):
+        self.max_workers = max_workers
+        self.queue = queue.Queue()
+        self.workers = []
+        self.lock = threading.Lock()
+
+    def submit(self, generate_fn, prompt):
+        future = Future()
+        self.queue.put((generate_fn, prompt, future))
+        with self.lock:
+            # started as thinks come in, up to max_workers
+            if len(self.workers) < self.max_workers:
+                worker = threading.Thread(
+                    target=self.work,
+                    name=f"think-async-{len(self.workers)}",
+                    daemon=True,
+                )
+                self.workers.append(worker)
+                worker.start()
+        return future
+
+    def work(self):
+        while True:
+            generate_fn, prompt, future = self.queue.get()
+            if not future.set_running_or_notify_cancel():
+                continue
+            try:
+                result = generate_fn(prompt)
+            except BaseException as e:
+                future.set_exception(e)
+            else:
+                future.set_result(result)
+
+
+think_pool = ThinkPool()
@@ -0,0 +1,216 @@
+#######################################
+# GENERATION BACKENDS
+#######################################
+
+import time
+import threading
+
+from rich.console import Console
+
+from . import daemon
+
+console = Console()
+
+
+class BackendUnavailable(Exception):
+    pass
+
+
+class Backend:
+    """
+    Where think code comes from once it is neither precompiled nor cached.
+    generate() returns the code for every prompt, or None when this backend
+    cannot serve right now and the next one should be asked
+    """
+
+    name = "backend"
+    # whether code from this backend goes into this process' code cache
+    cacheable = True
+
+    def generate(self, prompts):
+        raise NotImplementedError
+
+    def stream(self, prompt):
+        """
+        The code for a single prompt in pieces as it is written, or None like
+        generate(). Backends that cannot stream hand it over in one piece
+        """
+        codes = self.generate([prompt])
+        if codes is None:
+            return None
+        return iter([codes[prompt]])
+
+
+class TransformersBackend(Backend):
+    """The model loaded into this process"""
+
+    name = "transformers"
+
+    # the pipeline, async thinks and the interpreter may all generate at once,
+    # but the model and its shared preamble cache serve one call at a time
+    model_lock = threading.Lock()
+
+    def generate(self, prompts):
+        with self.model_lock:
+            return self.generate_locked(prompts)
+
+    def load(self):
+        """The tokenizer and model, a model that cannot be loaded fails the think"""
+        from .model import brain
+
+        try:
+            return brain.load()
+        except OSError as e:
+            if brain.offline:
+                raise BackendUnavailable(
+                    f"The model {brain.name} is not on disk, run without --offline to download it"
+                ) from e
+            raise BackendUnavailable(
+                f"Could not load the model {brain.name}: {e}"
+            ) from e
+
+    def generate_locked(self, prompts):
+        from . import generate_code
+
+        self.load()
+        if len(prompts) == 1:
+            with console.status(
+                "Generating spagetti code that is guaranteed to fail lol...\n"
+                + f"Your prompt: [blue underline]{prompts[0]}"
+            ) as status:
+                code, _ = generate_code.generate_validated(prompts[0])
+            return {prompts[0]: code}
+
+        codes = {}
+        for start in range(0, len(prompts), generate_code.batch_size):
+            chunk = prompts[start : start + generate_code.batch_size]
+            with console.status(
+                f"Generating {len(chunk)} helpings of spagetti code at once lol..."
+            ) as status:
+                responses = generate_code.generate_respose_batch(chunk)
+
+            for prompt, response in zip(chunk, responses):
+                codes[prompt], _ = generate_code.generate_validated(
+                    prompt, generate_code.clean_response(response)
+                )
+        return codes
+
+    def stream(self, prompt):
+        from transformers import TextIteratorStreamer
+        from . import generate_code
+
+        with self.model_lock:
+            tokenizer, _ = self.load()
+        streamer = TextIteratorStreamer(
+            tokenizer, skip_prompt=True, skip_special_tokens=True
+        )
+        cancel = threading.Event()
+        failures = []
+
+        # the lock is only held by the generating thread, so a think inside the
+        # streamed code waits for the model instead of deadlocking on it
+        def work():
+            try:
+                with self.model_lock:
+                    generate_code.generate_respose(prompt, streamer, cancel)
+            except BaseException as e:
+                failures.append(e)
+                streamer.end()
+
+        def chunks():
+            worker = threading.Thread(target=work, name="think-stream", daemon=True)
+            worker.start()
+            code = ""
+            try:
+                for chunk in generate_code.stream_code(streamer):
+                    code += chunk
+                    yield chunk
+            finally:
+                # the code may have failed halfway, the model can stop right away
+                cancel.set()
+                worker.join()
+            if failures:
+                raise failures[0]
+            # streamed code already ran, there is nothing left to retry
+            valid = generate_code.validate_code(code) is None
+            generate_code.record_validation(prompt, 1, 0 if valid else 1, valid)
+
+        return chunks()
+
+
+class DaemonBackend(Backend):
+    """A model daemon started with --serve, which caches on its own side"""
+
+    name = "daemon"
+    cacheable = False
+
+    def generate(self, prompts):
+        from .generate_code import generation_settings
+
+        return daemon.ask_daemon(prompts, generation_settings())
+
+
+class FakeBackend(Backend):
+    """
+    Canned code after a fixed delay, no model involved. Prompts without canned
+    code print themselves, so the same prompt always gives the same code
+    """
+
+    name = "fake"
+    cacheable = False
+
+    def __init__(self, delay=0.0, codes=None):
+        self.delay = delay
+        self.codes = codes or {}
+        self.calls = 0
+
+    def code_for(self, prompt):
+        if prompt in self.codes:
+            return self.codes[prompt]
+        escaped = prompt.replace("\\", "\\\\").replace('"', '\\"')
+        return f'print("{escaped}")\n'
+
+    def generate(self, prompts):
+        self.calls += 1
+        time.sleep(self.delay)
+        return {prompt: self.code_for(prompt) for prompt in prompts}
+
+    def stream(self, prompt):
+        self.calls += 1
+        # the delay is spread over the lines, as if they were written one by one
+        lines = self.code_for(prompt).splitlines(keepends=True) or [""]
+
+        def chunks():
+            for line in lines:
+                time.sleep(self.delay / len(lines))
+                yield line
+
+        return chunks()
+
+
+BACKENDS = ("auto", "transformers", "daemon", "fake")
+# backends whose code comes from the model, the only code worth precompiling
+MODEL_BACKENDS = ("transformers", "daemon")
+
+
+def make_backends(name, fake_delay=0.0):
+    """The backends to try in order for a --backend name"""
+    if name == "auto":
+        return [DaemonBackend(), TransformersBackend()]
+    if name == "transformers":
+        return [TransformersBackend()]
+    if name == "daemon":
+        return [DaemonBackend()]
+    if name == "fake":
+        return [FakeBackend(fake_delay)]
+    raise ValueError(f"Unknown backend '{name}', expected one of {BACKENDS}")
+
+
+def generate_with(backends, prompts):
+    """Code for the prompts from the first backend that can serve them"""
+    for backend in backends:
+        codes = backend.generate(prompts)
+        if codes is not None:
+            return backend, codes
+    names = ", ".join(backend.name for backend in backends)
+    raise BackendUnavailable(f"No think backend could generate code (tried {names})")
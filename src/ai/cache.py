@@ -0,0 +1,128 @@
+#######################################
+# GENERATED CODE CACHE
+#######################################
+
+import os
+import json
+import hashlib
+
+CACHE_DIR = os.path.join(os.getcwd(), "cache/generated")
+CACHE_MAX_BYTES = 16 * 1024 * 1024
+
+
+def hash_text(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def touch(path):
+    """Bumps the mtime so eviction sees this entry as recently used"""
+    try:
+        os.utime(path)
+    except OSError:
+        pass
+
+
+def evict_lru(directory, extension, max_bytes, keep=None):
+    """
+    Removes the least recently used files with the extension until the rest fit
+    in max_bytes, never keep. Returns how many were removed
+    """
+    entries = []
+    total = 0
+    for entry in os.scandir(directory):
+        if not entry.name.endswith(extension):
+            continue
+        try:
+            stat = entry.stat()
+        except OSError:
+            continue
+        entries.append((stat.st_mtime, stat.st_size, entry.path))
+        total += stat.st_size
+
+    entries.sort()
+    evicted = 0
+    for _, size, entry_path in entries:
+        if total <= max_bytes:
+            break
+        if entry_path == keep:
+            continue
+        try:
+            os.remove(entry_path)
+        except OSError:
+            continue
+        total -= size
+        evicted += 1
+    return evicted
+
+
+class CodeCache:
+    """
+    Content addressed on-disk cache of generated code, shared between processes.
+    Entries are evicted least recently used first once the cache grows past max_bytes
+    """
+
+    __slots__ = ("directory", "max_bytes", "hits", "misses", "evictions")
+
+    def __init__(self, directory=CACHE_DIR, max_bytes=CACHE_MAX_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @staticmethod
+    def make_key(prompt, model, revision, context_hash, params) -> str:
+        # generation is greedy, so these fully determine the output
+        return hash_text(
+            json.dumps(
+                {
+                    "prompt": prompt,
+                    "model": model,
+                    "revision": revision,
+                    "context": context_hash,
+                    "params": params,
+                },
+                sort_keys=True,
+            )
+        )
+
+    def entry_path(self, key):
+        return os.path.join(self.directory, key + ".think")
+
+    def get(self, key):
+        path = self.entry_path(key)
+        try:
+            with open(path, "r") as f:
+                code = f.read()
+        except OSError:
+            self.misses += 1
+            return None
+
+        touch(path)
+        self.hits += 1
+        return code
+
+    def put(self, key, code):
+        os.makedirs(self.directory, exist_ok=True)
+        path = self.entry_path(key)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w") as f:
+            f.write(code)
+        os.replace(tmp_path, path)
+        self.evict()
+
+    def evict(self):
+        self.evictions += evict_lru(self.directory, ".think", self.max_bytes)
+
+    def clear(self):
+        if not os.path.isdir(self.directory):
+            return
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith(".think"):
+                os.remove(entry.path)
+
+    def stats(self):
+        return {"hits": self.hits, "misses": self.misses, "evictions": self.evictions}
+
+
+code_cache = CodeCache()
@@ -0,0 +1,111 @@
+#######################################
+# AHEAD OF TIME THINK EXPANSION
+#######################################
+
+import json
+
+from ..consts import VERSION, THINK_ALWAYS
+from ..lib.lex import Lexer
+from ..lib.parser import Parser
+from ..lib.nodes import ThinkNode, StringNode, walk
+from . import generate_code
+from .model import brain
+from .backends import MODEL_BACKENDS
+from .generate_code import think_code_batch, validate_code
+from .memo import think_memo
+from .precompiled import precompiled, sidecar_path
+from .pipeline import think_pipeline
+
+
+def collect_think_prompts(fn, source_code):
+    """
+    Constant prompts of every think statement, in source order. Thinks with the
+    'always' policy generate fresh code every time, so they are left out
+    """
+    prompts = []
+    for code in source_code:
+        lexer = Lexer(fn, code)
+        ast = Parser(lexer.generate_tokens()).parse()
+        if lexer.error:
+            return None, lexer.error
+        if ast.error:
+            return None, ast.error
+
+        for node in walk(ast.node):
+            if (
+                isinstance(node, ThinkNode)
+                and isinstance(node.node_to_think, StringNode)
+                and think_memo.policy_of(node) != THINK_ALWAYS
+            ):
+                prompt = node.node_to_think.tok.value
+                if prompt not in prompts:
+                    prompts.append(prompt)
+
+    return prompts, None
+
+
+def compile_script(script_path, source_code):
+    """
+    Generates code for all constant think prompts up front and writes it to a
+    sidecar next to the script, which 'think.py' picks up at runtime. Code that
+    is empty or does not parse is left out, so those thinks still generate when
+    they run. Only the model may write a sidecar, which records the backends it
+    was generated with. Returns the sidecar path, why each left out prompt was
+    and the error
+    """
+    backends = [backend.name for backend in generate_code.backends]
+    if not all(name in MODEL_BACKENDS for name in backends):
+        return (
+            None,
+            {},
+            f"Only the model can compile thinks, not the {', '.join(backends)} backend",
+        )
+
+    prompts, error = collect_think_prompts(script_path, source_code)
+    if error:
+        return None, {}, error
+
+    thinks = {}
+    invalid = {}
+    for prompt, code in think_code_batch(prompts).items():
+        if not code.strip():
+            invalid[prompt] = "nothing was generated"
+            continue
+        error = validate_code(code)
+        if error is not None:
+            invalid[prompt] = f"{error.error_name}: {error.details}"
+            continue
+        thinks[prompt] = code
+
+    path = sidecar_path(script_path)
+    with open(path, "w") as f:
+        json.dump(
+            {
+                "version": VERSION,
+                "model": brain.name,
+                "revision": brain.revision,
+                "backends": backends,
+                "thinks": thinks,
+            },
+            f,
+            indent=4,
+        )
+    return path, invalid, None
+
+
+def prefetch_script(script_path, source_code):
+    """
+    Generates all constant think prompts of a script in batches before it runs,
+    so each think statement finds its code ready instead of calling the model.
+    With the pipeline running this happens in the background instead
+    """
+    prompts, error = collect_think_prompts(script_path, source_code)
+    if error or not prompts:
+        return 0
+
+    pending = [prompt for prompt in prompts if not precompiled.has(prompt)]
+    if think_pipeline.running:
+        think_pipeline.submit(pending)
+    else:
+        precompiled.bodies.update(think_code_batch(pending))
+    return len(pending)
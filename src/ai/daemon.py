@@ -0,0 +1,229 @@
+#######################################
+# MODEL DAEMON
+#######################################
+
+import os
+import sys
+import json
+import queue
+import signal
+import socket
+import tempfile
+import threading
+import socketserver
+from concurrent.futures import Future
+
+from rich.console import Console
+
+console = Console()
+
+
+def private_dir():
+    """
+    A directory only this user can get into. The shared tmp dir is not one,
+    anybody could put a socket there before the daemon starts
+    """
+    runtime = os.environ.get("XDG_RUNTIME_DIR")
+    if runtime:
+        return runtime
+    return os.path.join(tempfile.gettempdir(), f"thinklang-{os.getuid()}")
+
+
+# one daemon per user, shared by every think.py run no matter where it started
+socket_path = os.environ.get(
+    "THINKLANG_SOCKET", os.path.join(private_dir(), "thinklang.sock")
+)
+# set by --no-daemon, always generate in process
+use_daemon = True
+
+CONNECT_TIMEOUT = 1.0
+
+
+def send_message(sock_file, message):
+    sock_file.write(json.dumps(message).encode("utf-8") + b"\n")
+    sock_file.flush()
+
+
+def read_message(sock_file):
+    line = sock_file.readline()
+    if not line:
+        return None
+    return json.loads(line)
+
+
+def owned(path):
+    try:
+        return os.stat(path).st_uid == os.getuid()
+    except OSError:
+        return False
+
+
+def connect(path=None):
+    """
+    A socket to the daemon, None if no daemon is listening. The daemon's code is
+    run as it is, so a socket another user made is never connected to
+    """
+    path = path or socket_path
+    if not os.path.exists(path):
+        return None
+    if not owned(path):
+        console.print(
+            f"Ignoring the model daemon at {path}, it belongs to another user",
+            style="bold red",
+        )
+        return None
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    sock.settimeout(CONNECT_TIMEOUT)
+    try:
+        sock.connect(path)
+    except OSError:
+        sock.close()
+        return None
+    # generating can take minutes, only connecting is bounded
+    sock.settimeout(None)
+    return sock
+
+
+def ask_daemon(prompts, settings):
+    """
+    Code for the prompts from the daemon, or None when there is no daemon to ask
+    and the caller should generate in process instead
+    """
+    if not use_daemon:
+        return None
+    sock = connect()
+    if sock is None:
+        return None
+
+    with sock, sock.makefile("rwb") as sock_file:
+        try:
+            send_message(sock_file, {"prompts": prompts, "settings": settings})
+            reply = read_message(sock_file)
+        except (OSError, ValueError):
+            return None
+
+    if reply is None or "error" in reply:
+        if reply is not None:
+            console.print(f"Model daemon failed: {reply['error']}", style="bold red")
+        return None
+    # None when the daemon runs another model or runs it differently
+    return reply["codes"]
+
+
+class ThinkDaemon:
+    """
+    Keeps the model loaded and generates for every think.py run that connects.
+    Connections only queue their prompts, a single worker owns the model and
+    generates everything queued with the same settings in one batch. A run that
+    wants another model, dtype, thread count or models dir is turned away, and
+    generates in its own process
+    """
+
+    __slots__ = ("path", "queue", "server", "worker")
+
+    def __init__(self, path=None):
+        self.path = path or socket_path
+        self.queue = queue.Queue()
+        self.server = None
+        self.worker = None
+
+    def submit(self, prompts, settings):
+        future = Future()
+        self.queue.put((prompts, settings, future))
+        return future
+
+    def drain(self):
+        """Blocks for one request, then takes whatever else is already waiting"""
+        requests = [self.queue.get()]
+        while True:
+            try:
+                requests.append(self.queue.get_nowait())
+            except queue.Empty:
+                return requests
+
+    def work(self):
+        from . import generate_code
+        from .backends import TransformersBackend
+
+        # the daemon generates everything itself, it must never ask itself
+        generate_code.backends = [TransformersBackend()]
+        while True:
+            groups = {}
+            for prompts, settings, future in self.drain():
+                key = json.dumps(settings, sort_keys=True)
+                groups.setdefault(key, (settings, []))[1].append((prompts, future))
+
+            for settings, requests in groups.values():
+                prompts = [prompt for request, _ in requests for prompt in request]
+                try:
+                    generate_code.apply_generation_settings(settings)
+                    codes = generate_code.think_code_batch(list(dict.fromkeys(prompts)))
+                except Exception as e:
+                    for _, future in requests:
+                        future.set_exception(e)
+                    continue
+                for request, future in requests:
+                    future.set_result({prompt: codes[prompt] for prompt in request})
+
+    def handler(self):
+        from . import generate_code
+
+        daemon = self
+
+        class Handler(socketserver.StreamRequestHandler):
+            def handle(self):
+                request = read_message(self.rfile)
+                if request is None:
+                    return
+                # the client generates itself with the model it asked for instead
+                if generate_code.model_mismatch(request["settings"].get("model", {})):
+                    send_message(self.wfile, {"codes": None})
+                    return
+                try:
+                    codes = daemon.submit(
+                        request["prompts"], request["settings"]
+                    ).result()
+                    reply = {"codes": codes}
+                except Exception as e:
+                    reply = {"error": str(e)}
+                send_message(self.wfile, reply)
+
+        return Handler
+
+    def bind(self):
+        directory = os.path.dirname(self.path)
+        if directory == private_dir():
+            os.makedirs(directory, mode=0o700, exist_ok=True)
+            # made by someone else before this user ever ran a daemon
+            if not owned(directory) or os.stat(directory).st_mode & 0o077:
+                raise OSError(
+                    f"{directory} is not private to this user, remove it or set THINKLANG_SOCKET"
+                )
+
+        if os.path.exists(self.path):
+            sock = connect(self.path)
+            if sock is not None:
+                sock.close()
+                raise OSError(f"A model daemon is already listening on {self.path}")
+            # left behind by a daemon that did not shut down cleanly
+            os.unlink(self.path)
+
+        self.server = socketserver.ThreadingUnixStreamServer(self.path, self.handler())
+        self.server.daemon_threads = True
+        # only this user's runs may hand the model prompts
+        os.chmod(self.path, 0o600)
+
+    def serve(self):
+        self.bind()
+        # daemons are usually stopped with SIGTERM, the socket is removed then too
+        signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+        self.worker = threading.Thread(
+            target=self.work, name="think-daemon", daemon=True
+        )
+        self.worker.start()
+        try:
+            self.server.serve_forever()
+        finally:
+            self.server.server_close()
+            if os.path.exists(self.path):
+                os.unlink(self.path)
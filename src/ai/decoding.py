@@ -0,0 +1,244 @@
+#######################################
+# DECODING CONTROL
+#######################################
+
+# only imported once the model is loaded, transformers is too heavy for startup
+
+import re
+import time
+
+import torch
+from transformers import StoppingCriteria, LogitsProcessor
+
+from ..lib.lex import (
+    lex_step,
+    LS_ILLEGAL,
+    LS_CODE,
+    LS_BANG,
+    LS_STRING,
+    LS_STRING_ESCAPE,
+    LS_STRING_SINGLE,
+    LS_COMMENT,
+)
+
+CLOSED_FENCE = re.compile(r"```(\S*)\n(.*?)```", re.DOTALL)
+OPEN_FENCE = re.compile(r"```\S*\n")
+
+# a backtick in code can only start the closing fence, nothing is checked after it
+LS_FENCE = 6
+LEX_STATES = (
+    LS_CODE,
+    LS_BANG,
+    LS_STRING,
+    LS_STRING_ESCAPE,
+    LS_STRING_SINGLE,
+    LS_COMMENT,
+)
+
+
+class CodeFenceStoppingCriteria(StoppingCriteria):
+    """
+    Ends a row as soon as it has written a complete ``` block. Everything after
+    the first closing fence is thrown away by clean_response() anyway
+    """
+
+    def __init__(self, tokenizer, prompt_length):
+        self.tokenizer = tokenizer
+        self.prompt_length = prompt_length
+        # generated length at which each row closed its fence
+        self.stopped_at = {}
+        # length already looked at, speculative decoding adds several tokens at once
+        self.checked = prompt_length
+
+    def __call__(self, input_ids, scores, **kwargs):
+        done = torch.zeros(
+            input_ids.shape[0], dtype=torch.bool, device=input_ids.device
+        )
+        steps = input_ids.shape[1] - self.prompt_length
+        new_from = min(self.checked, input_ids.shape[1] - 1)
+        self.checked = input_ids.shape[1]
+
+        for row in range(input_ids.shape[0]):
+            if row in self.stopped_at:
+                done[row] = True
+                continue
+
+            # cheap check first, a fence can only close on a token with a backtick
+            new = self.tokenizer.decode(input_ids[row, new_from:])
+            if "`" not in new:
+                continue
+
+            text = self.tokenizer.decode(
+                input_ids[row, self.prompt_length :], skip_special_tokens=True
+            )
+            if CLOSED_FENCE.search(text):
+                self.stopped_at[row] = steps
+                done[row] = True
+
+        return done
+
+    def trim(self, outputs, max_new_tokens):
+        """
+        The outputs cut down to max_new_tokens generated tokens. Drafted tokens are
+        accepted several at a time and can run past the budget, a fence closed
+        after it no longer counts as closed in time
+        """
+        budget = self.prompt_length + max_new_tokens
+        if outputs.shape[1] <= budget:
+            return outputs
+        for row, steps in list(self.stopped_at.items()):
+            if steps > max_new_tokens:
+                del self.stopped_at[row]
+        return outputs[:, :budget]
+
+    def steps(self, outputs, row, pad_token_id):
+        """Decode steps a row actually needed"""
+        if row in self.stopped_at:
+            return self.stopped_at[row]
+        generated = outputs[row, self.prompt_length :]
+        return int((generated != pad_token_id).sum())
+
+
+class StepTimer(StoppingCriteria):
+    """
+    Never stops anything, it is only called once per decode step. The first call
+    comes right after the prefill, every later one after a decode step
+    """
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.first = None
+        self.last = None
+
+    def __call__(self, input_ids, scores, **kwargs):
+        self.last = time.perf_counter()
+        if self.first is None:
+            self.first = self.last
+        return torch.zeros(
+            input_ids.shape[0], dtype=torch.bool, device=input_ids.device
+        )
+
+    def prefill_seconds(self):
+        return (self.first or time.perf_counter()) - self.start
+
+    def decode_seconds(self):
+        return self.last - self.first if self.first is not None else 0.0
+
+
+class CancelStoppingCriteria(StoppingCriteria):
+    """Ends every row once the event is set, when nobody reads the output anymore"""
+
+    def __init__(self, event):
+        self.event = event
+
+    def __call__(self, input_ids, scores, **kwargs):
+        return torch.full(
+            (input_ids.shape[0],),
+            self.event.is_set(),
+            dtype=torch.bool,
+            device=input_ids.device,
+        )
+
+
+def code_step(state, char):
+    if state == LS_FENCE or (state == LS_CODE and char == "`"):
+        return LS_FENCE
+    return lex_step(state, char)
+
+
+# per tokenizer: the text of every token, and which tokens each lex state allows
+token_tables = {}
+
+
+def token_table(tokenizer, vocab_size):
+    key = (id(tokenizer), vocab_size)
+    if key in token_tables:
+        return token_tables[key]
+
+    texts = [tokenizer.decode([token]) for token in range(len(tokenizer))]
+    texts += [""] * (vocab_size - len(texts))
+    special_ids = [token for token in tokenizer.all_special_ids if token < vocab_size]
+
+    allowed = {}
+    for start in LEX_STATES:
+        legal = []
+        for token, text in enumerate(texts):
+            state = start
+            for char in text:
+                state = code_step(state, char)
+                if state == LS_ILLEGAL:
+                    break
+            legal.append(state != LS_ILLEGAL and token < len(tokenizer))
+        mask = torch.tensor(legal, dtype=torch.bool)
+        mask[special_ids] = True
+        allowed[start] = mask
+    allowed[LS_FENCE] = None
+
+    token_tables[key] = (texts, allowed)
+    return token_tables[key]
+
+
+class LexerLogitsProcessor(LogitsProcessor):
+    """
+    Masks every token that would make the code inside the ``` block fail to lex,
+    like an illegal character or a '!' not followed by '='. Each row keeps the lex
+    state of its code so far, and which tokens a state allows is worked out once
+    per tokenizer for the whole vocabulary
+    """
+
+    def __init__(self, tokenizer, prompt_length):
+        self.tokenizer = tokenizer
+        self.prompt_length = prompt_length
+        # row -> (tokens consumed, (text before the opening fence, lex state) after each)
+        self.rows = {}
+
+    def advance(self, row, input_ids, texts):
+        tokens, states = self.rows.setdefault(row, ([], [("", None)]))
+        generated = input_ids[self.prompt_length :].tolist()
+
+        # speculative decoding scores draft tokens that can get rejected, so the
+        # sequence may have moved back instead of only growing by one
+        if generated[: len(tokens)] != tokens:
+            common = 0
+            limit = min(len(tokens), len(generated))
+            while common < limit and tokens[common] == generated[common]:
+                common += 1
+            del tokens[common:]
+            del states[common + 1 :]
+
+        before_fence, state = states[-1]
+        for token in generated[len(tokens) :]:
+            text = texts[token]
+            if state is None:
+                before_fence += text
+                match = OPEN_FENCE.search(before_fence)
+                if match:
+                    state, text = LS_CODE, before_fence[match.end() :]
+                else:
+                    text = ""
+
+            for char in text:
+                state = code_step(state, char)
+                if state == LS_ILLEGAL:
+                    # only reachable through tokens this processor never saw
+                    state = LS_FENCE
+                    break
+
+            tokens.append(token)
+            states.append((before_fence, state))
+
+        return state
+
+    def __call__(self, input_ids, scores):
+        texts, allowed = token_table(self.tokenizer, scores.shape[-1])
+
+        for row in range(input_ids.shape[0]):
+            state = self.advance(row, input_ids[row], texts)
+            # nothing is constrained before the code block opens or after it closes
+            if state is None or allowed[state] is None:
+                continue
+            scores[row] = scores[row].masked_fill(
+                ~allowed[state].to(scores.device), float("-inf")
+            )
+
+        return scores
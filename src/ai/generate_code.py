@@ -2,72 +2,356 @@ import os
 
 os.environ["TRANSFORMERS_VERBOSITY"] = "error"
 os.environ["PYTHONWARNINGS"] = "ignore"
-os.environ["HF_HOME"] = os.getcwd() + "/cache/models"
 
 import logging
 
 logging.basicConfig(level="ERROR")
 
-import src
-from transformers import AutoTokenizer, AutoModelForCausalLM
-import torch
 import re
 
 from rich.console import Console
 
+from .model import brain
+from .cache import code_cache
+from .prompt import prompt_context
+from .prefix_cache import prefix_cache
+from .precompiled import precompiled
+from .pipeline import think_pipeline
+from .backends import make_backends, generate_with, BackendUnavailable
+from .ast_cache import think_asts
+from .stats import decode_stats, validation_stats, think_stats
+
 console = Console()
 
-model_name = "deepseek-ai/deepseek-coder-1.3b-instruct"
+# decoding is greedy, so the same prompt always yields the same code
+generation_params = {
+    "max_new_tokens": 512,
+    "do_sample": False,
+    "num_return_sequences": 1,
+}
 
-with console.status(
-    "Importing the brains behind this stupid language (Deepseek lol)..."
-) as status:
-    tokenizer = AutoTokenizer.from_pretrained(model_name, trust_remote_code=True)
-    model = AutoModelForCausalLM.from_pretrained(
-        model_name,
-        trust_remote_code=True,
-        torch_dtype=torch.bfloat16,
-    )
-path = os.getcwd() + "/examples"
+# most prompts generated together in one model.generate call
+batch_size = 8
+
+# asked in order for code that is neither precompiled nor cached
+backends = make_backends("auto")
+
+# generated code copies a lot from the examples, so up to this many tokens are
+# drafted from n-gram matches in the prompt and verified in one forward pass.
+# Greedy output stays the same, 0 turns it off
+prompt_lookup_tokens = 10
+
+# mask tokens that would make the generated code fail to lex
+constrain_to_lexer = True
+
+# code that does not parse is retried by sampling, the values that were
+# commented out of generate_respose since the beginning
+sampling_params = {"do_sample": True, "top_k": 50, "top_p": 0.95}
+# samples drawn per attempt, in a single model.generate call
+candidates = 1
+# generate calls a single think may spend, the first one included
+max_attempts = 3
+
+
+def set_token_budget(max_new_tokens: int):
+    """Most tokens a single think may generate"""
+    generation_params["max_new_tokens"] = max_new_tokens
+
+
+def cache_params():
+    """Everything besides the prompt that changes what the model writes"""
+    return {
+        **generation_params,
+        "lexer_constraint": constrain_to_lexer,
+        "retrieval": prompt_context.retrieval,
+        "inference": brain.config.describe(),
+        # code that needed a retry was sampled, not decoded greedily
+        "retries": (
+            {"max_attempts": max_attempts, "candidates": candidates, **sampling_params}
+            if max_attempts > 1
+            else None
+        ),
+    }
+
+
+def model_settings():
+    """The model this run would load and how it would run it"""
+    return {
+        "name": brain.name,
+        "revision": brain.revision,
+        "inference": brain.config.describe(),
+        "threads": brain.config.threads,
+        "compile": brain.config.compile,
+        "models_dir": brain.models_dir,
+        "offline": brain.offline,
+    }
+
+
+def model_mismatch(wanted):
+    """
+    The first model setting a client wants that this process runs differently,
+    None when it can generate for the client
+    """
+    ours = model_settings()
+    for name, value in wanted.items():
+        # the daemon loaded its model when it started, it never downloads for anyone
+        if name == "offline":
+            continue
+        # a client that did not pick a thread count takes whatever the daemon uses
+        if name == "threads" and value is None:
+            continue
+        if ours.get(name) != value:
+            return f"{name} is {ours.get(name)}, not {value}"
+    return None
+
+
+def generation_settings():
+    """What this run was told to generate with, for a daemon to generate the same"""
+    return {
+        "model": model_settings(),
+        "max_new_tokens": generation_params["max_new_tokens"],
+        "constrain_to_lexer": constrain_to_lexer,
+        "candidates": candidates,
+        "max_attempts": max_attempts,
+        "prompt_lookup_tokens": prompt_lookup_tokens,
+        "retrieval": prompt_context.retrieval,
+    }
+
+
+def apply_generation_settings(settings):
+    global constrain_to_lexer, candidates, max_attempts, prompt_lookup_tokens
+
+    set_token_budget(settings["max_new_tokens"])
+    constrain_to_lexer = settings["constrain_to_lexer"]
+    candidates = settings["candidates"]
+    max_attempts = settings["max_attempts"]
+    prompt_lookup_tokens = settings["prompt_lookup_tokens"]
+    if settings["retrieval"] is None:
+        if prompt_context.retrieval is not None:
+            prompt_context.retrieval = None
+            prompt_context.prefix_ids = None
+    elif tuple(settings["retrieval"]) != prompt_context.retrieval:
+        prompt_context.enable_retrieval(*settings["retrieval"])
+
+
+def lookup_params():
+    """
+    Prompt-lookup drafting, only for single prompts, generate cannot batch it.
+    Streamed prompts go without, see CodeFenceStoppingCriteria.trim
+    """
+    if not prompt_lookup_tokens:
+        return {}
+    return {"prompt_lookup_num_tokens": prompt_lookup_tokens}
+
+
+def logits_processors(tokenizer, prompt_length):
+    from .decoding import LexerLogitsProcessor
+
+    if not constrain_to_lexer:
+        return []
+    return [LexerLogitsProcessor(tokenizer, prompt_length)]
+
+
+def pad_token_of(tokenizer):
+    if tokenizer.pad_token_id is not None:
+        return tokenizer.pad_token_id
+    return tokenizer.eos_token_id
+
+
+def record_generation(prompts, outputs, fence_stop, timer, prompt_tokens):
+    """Decode steps of every row, and what the generate call cost each prompt"""
+    pad_token_id = pad_token_of(fence_stop.tokenizer)
+    seen = set()
+    for row, prompt in enumerate(prompts):
+        steps = fence_stop.steps(outputs, row, pad_token_id)
+        saved = decode_stats.record(
+            prompt,
+            steps,
+            generation_params["max_new_tokens"],
+            row in fence_stop.stopped_at,
+        )
+        think_stats.add(prompt, generated_tokens=steps, steps_saved=saved)
+        # candidates repeat a prompt, its tokens and the time only count once
+        if prompt not in seen:
+            seen.add(prompt)
+            think_stats.add(
+                prompt,
+                prompt_tokens=prompt_tokens[row],
+                prefill_seconds=timer.prefill_seconds(),
+                decode_seconds=timer.decode_seconds(),
+            )
+
+
+def record_validation(prompt, attempts, failures, valid):
+    validation_stats.record(prompt, attempts, failures, valid)
+    think_stats.add(prompt, validation_attempts=attempts, validation_failures=failures)
+
+
+def gather_context() -> str:
+    return prompt_context.refresh().text
 
 
 def gather_prompt(prompt: str) -> str:
-    training_codes = ""
-    sample_codes = [f"{path}/{f}" for f in os.listdir(path=path)]
-    sample_codes.append(os.getcwd() + "/src/std/math.think")
+    return prompt_context.render(prompt)
 
-    # map them into a single string and feed that into the model as context
-    for code_loc in sample_codes:
-        with open(code_loc) as f:
-            training_codes += f.read()
-            training_codes += "\n"
 
-    instruct_prompt = f"""You are a software developer writing code in a new language. The language syntax is shown below:
-        {training_codes}
+def generate_respose(prompt: str, streamer=None, cancel=None) -> str:
+    import torch
+    from .decoding import CodeFenceStoppingCriteria, CancelStoppingCriteria, StepTimer
 
-        You are to code in this langauge using this syntax. Write just the source code without any explanation. Keep all the source code inside triple backticks (`).
-        
-        Prompt: {prompt}"""
+    tokenizer, model = brain.load()
+    # only the user prompt is tokenized here, the syntax preamble is reused
+    inputs = torch.tensor([prompt_context.encode(tokenizer, prompt)]).to(model.device)
+    prefix_ids = prompt_context.tokenize_prefix(tokenizer)
+    fence_stop = CodeFenceStoppingCriteria(tokenizer, inputs.shape[1])
+    # started before the preamble is borrowed, prefilling it counts as prefill too
+    timer = StepTimer()
+    stopping_criteria = [fence_stop, timer]
+    if cancel is not None:
+        stopping_criteria.append(CancelStoppingCriteria(cancel))
+
+    # the preamble is already prefilled, generate only has to process the prompt
+    with prefix_cache.borrow(
+        brain.name, brain.revision, model, prefix_ids
+    ) as past_key_values:
+        # tokenizer.eos_token_id is the id of <|EOT|> token
+        outputs = model.generate(
+            inputs,
+            past_key_values=past_key_values,
+            stopping_criteria=stopping_criteria,
+            logits_processor=logits_processors(tokenizer, inputs.shape[1]),
+            streamer=streamer,
+            **generation_params,
+            # streamed text is out before drafting past the budget could be undone
+            **({} if streamer is not None else lookup_params()),
+            # top_k=50,
+            # top_p=0.95,
+            eos_token_id=tokenizer.eos_token_id,
+        )
+    outputs = fence_stop.trim(outputs, generation_params["max_new_tokens"])
+    record_generation([prompt], outputs, fence_stop, timer, [inputs.shape[1]])
+    return tokenizer.decode(outputs[0][len(inputs[0]) :], skip_special_tokens=True)
 
-    return instruct_prompt
 
+def generate_respose_batch(prompts: list) -> list:
+    import torch
+    from .decoding import CodeFenceStoppingCriteria, StepTimer
 
-def generate_respose(prompt: str) -> str:
-    messages = [{"role": "user", "content": prompt}]
-    inputs = tokenizer.apply_chat_template(
-        messages, add_generation_prompt=True, return_tensors="pt"
-    ).to(model.device)
-    # tokenizer.eos_token_id is the id of <|EOT|> token
+    tokenizer, model = brain.load()
+    prefix_ids = prompt_context.tokenize_prefix(tokenizer)
+    pad_token_id = pad_token_of(tokenizer)
+
+    suffixes = [
+        prompt_context.encode(tokenizer, prompt)[len(prefix_ids) :]
+        for prompt in prompts
+    ]
+    width = max(len(suffix) for suffix in suffixes)
+
+    # padding goes between the shared preamble and each prompt, so every row
+    # starts with the same preamble and can reuse its cached key/values
+    input_ids = []
+    attention_mask = []
+    for suffix in suffixes:
+        padding = width - len(suffix)
+        input_ids.append(prefix_ids + [pad_token_id] * padding + suffix)
+        attention_mask.append([1] * len(prefix_ids) + [0] * padding + [1] * len(suffix))
+
+    input_ids = torch.tensor(input_ids).to(model.device)
+    attention_mask = torch.tensor(attention_mask).to(model.device)
+    timer = StepTimer()
+    past_key_values = prefix_cache.expand(
+        brain.name, brain.revision, model, prefix_ids, len(prompts)
+    )
+    fence_stop = CodeFenceStoppingCriteria(tokenizer, input_ids.shape[1])
     outputs = model.generate(
-        inputs,
-        max_new_tokens=512,
-        do_sample=False,
-        # top_k=50,
-        # top_p=0.95,
-        num_return_sequences=1,
+        input_ids,
+        attention_mask=attention_mask,
+        past_key_values=past_key_values,
+        pad_token_id=pad_token_id,
+        stopping_criteria=[fence_stop, timer],
+        logits_processor=logits_processors(tokenizer, input_ids.shape[1]),
+        **generation_params,
         eos_token_id=tokenizer.eos_token_id,
     )
-    return tokenizer.decode(outputs[0][len(inputs[0]) :], skip_special_tokens=True)
+    record_generation(
+        prompts,
+        outputs,
+        fence_stop,
+        timer,
+        [len(prefix_ids) + len(suffix) for suffix in suffixes],
+    )
+    return tokenizer.batch_decode(
+        outputs[:, input_ids.shape[1] :], skip_special_tokens=True
+    )
+
+
+def generate_candidates(prompt: str, count: int) -> list:
+    import torch
+    from .decoding import CodeFenceStoppingCriteria, StepTimer
+
+    tokenizer, model = brain.load()
+    prefix_ids = prompt_context.tokenize_prefix(tokenizer)
+    input_ids = torch.tensor([prompt_context.encode(tokenizer, prompt)] * count).to(
+        model.device
+    )
+    timer = StepTimer()
+    past_key_values = prefix_cache.expand(
+        brain.name, brain.revision, model, prefix_ids, count
+    )
+    fence_stop = CodeFenceStoppingCriteria(tokenizer, input_ids.shape[1])
+    outputs = model.generate(
+        input_ids,
+        past_key_values=past_key_values,
+        pad_token_id=pad_token_of(tokenizer),
+        stopping_criteria=[fence_stop, timer],
+        logits_processor=logits_processors(tokenizer, input_ids.shape[1]),
+        max_new_tokens=generation_params["max_new_tokens"],
+        **sampling_params,
+        eos_token_id=tokenizer.eos_token_id,
+    )
+    record_generation(
+        [prompt] * count, outputs, fence_stop, timer, [input_ids.shape[1]] * count
+    )
+    return tokenizer.batch_decode(
+        outputs[:, input_ids.shape[1] :], skip_special_tokens=True
+    )
+
+
+def validate_code(code: str):
+    """The lex or parse error of a piece of code, None if it would run"""
+    # parsed through the AST cache, so running the code later does not parse again
+    return think_asts.compile(code)[1]
+
+
+def generate_validated(prompt: str, response: str = None):
+    """
+    Generates until some code lexes and parses, within max_attempts generate
+    calls. The first attempt is greedy (or the response a batch already made),
+    the rest sample `candidates` codes at once and take the first valid one.
+    Returns the code and whether it is valid, the first attempt if none is
+    """
+    attempts = 1
+    failures = 0
+
+    if response is None:
+        response = clean_response(generate_respose(prompt=prompt))
+    if validate_code(response) is None:
+        record_validation(prompt, attempts, failures, True)
+        return response, True
+    failures += 1
+
+    while attempts < max_attempts:
+        attempts += 1
+        for candidate in generate_candidates(prompt, candidates):
+            candidate = clean_response(candidate)
+            if validate_code(candidate) is None:
+                record_validation(prompt, attempts, failures, True)
+                return candidate, True
+            failures += 1
+
+    # hand over the first attempt anyway, so its error is what the user gets to see
+    record_validation(prompt, attempts, failures, False)
+    return response, False
 
 
 def extract_triple_backtick_blocks(text):
@@ -86,16 +370,127 @@ def clean_response(response: str) -> str:
     return runnable_code
 
 
-def generate_code(initial_prompt: str) -> str:
-    with console.status(
-        "Generating spagetti code that is guaranteed to fail lol...\n"
-        + f"Your prompt: [blue underline]{initial_prompt}"
-    ) as status:
-        prompt = gather_prompt(prompt=initial_prompt)
-        response = generate_respose(prompt=prompt)
-        response = clean_response(response)
+def stream_code(texts):
+    """
+    The code inside the first ``` block of a response that arrives in pieces,
+    each piece passed on as soon as it cannot be part of the closing fence
+    """
+    from .decoding import OPEN_FENCE
+
+    text = ""
+    start = None
+    sent = 0
+    for piece in texts:
+        text += piece
+        if start is None:
+            match = OPEN_FENCE.search(text)
+            if match is None:
+                continue
+            start = sent = match.end()
+
+        end = text.find("```", start)
+        if end != -1:
+            if end > sent:
+                yield text[sent:end]
+            return
+
+        # trailing backticks may still become the closing fence
+        safe = len(text.rstrip("`"))
+        if safe > sent:
+            yield text[sent:safe]
+            sent = safe
+
+
+def cache_key(prompt: str) -> str:
+    return code_cache.make_key(
+        prompt,
+        brain.name,
+        brain.revision,
+        prompt_context.refresh().hash,
+        cache_params(),
+    )
+
+
+def think_code(initial_prompt: str, fresh: bool = False) -> str:
+    """Code for a prompt, from the precompiled sidecar, the cache or a backend"""
+    return think_code_batch([str(initial_prompt)], fresh)[str(initial_prompt)]
+
+
+def think_code_batch(prompts: list, fresh: bool = False) -> dict:
+    """
+    Code for several prompts at once. Anything not already precompiled or cached
+    is handed to the backends together, so the model can generate it in batches.
+    Fresh code skips the cache, only precompiled code is still used
+    """
+    results = {}
+    pending = {}
+    for prompt in prompts:
+        response = precompiled.get(prompt)
+        source = "precompiled"
+        if response is None:
+            key = cache_key(prompt)
+            response = None if fresh else code_cache.get(key)
+            source = "cache"
+            if response is None:
+                pending[prompt] = key
+                continue
+        think_stats.note_source(prompt, source)
+        results[prompt] = response
+
+    if pending:
+        backend, codes = generate_with(backends, list(pending))
+        for prompt, response in codes.items():
+            think_stats.note_source(prompt, backend.name)
+            # code that does not parse is a failed generation, let the next run retry it
+            if backend.cacheable and validate_code(response) is None:
+                code_cache.put(pending[prompt], response)
+        results.update(codes)
+
+    return results
+
+
+def think_code_stream(initial_prompt: str, fresh: bool = False):
+    """
+    Code for a prompt in pieces, as the backend writes it. Precompiled, cached
+    and already pipelined code is complete and comes in one piece
+    """
+    prompt = str(initial_prompt)
+    # waiting on a pipelined generation would be slower than streaming a new one
+    if think_pipeline.running and not fresh and think_pipeline.done(prompt):
+        yield think_pipeline.result(prompt)
+        return
+
+    response = precompiled.get(prompt)
+    source = "precompiled"
+    if response is None:
+        key = cache_key(prompt)
+        response = None if fresh else code_cache.get(key)
+        source = "cache"
+    if response is not None:
+        think_stats.note_source(prompt, source)
+        yield response
+        return
+
+    for backend in backends:
+        chunks = backend.stream(prompt)
+        if chunks is None:
+            continue
+        think_stats.note_source(prompt, backend.name)
+        code = ""
+        for chunk in chunks:
+            code += chunk
+            yield chunk
+        if backend.cacheable and validate_code(code) is None:
+            code_cache.put(key, code)
+        return
+    names = ", ".join(backend.name for backend in backends)
+    raise BackendUnavailable(f"No think backend could generate code (tried {names})")
+
 
-    src.interpreter.run("<stdin>", response)
-    return response
+def generate_code(initial_prompt: str, fresh: bool = False) -> str:
+    if think_pipeline.running and not fresh:
+        # the worker may already be generating this prompt, or even be done
+        return think_pipeline.result(str(initial_prompt))
+    return think_code(initial_prompt, fresh)
 
     # ask it to generate new code based on the syntax
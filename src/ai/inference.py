@@ -0,0 +1,63 @@
+#######################################
+# INFERENCE CONFIG
+#######################################
+
+DTYPES = ("fp32", "bf16")
+
+
+class InferenceConfig:
+    """
+    How the model runs on the CPU: the dtype it is loaded in, whether its linear
+    layers are dynamically quantized to int8, how many threads torch uses and
+    whether the forward pass goes through torch.compile
+    """
+
+    __slots__ = ("dtype", "quantize", "threads", "compile")
+
+    def __init__(self, dtype="bf16", quantize=False, threads=None, compile=False):
+        if dtype not in DTYPES:
+            raise ValueError(f"Unknown dtype '{dtype}', expected one of {DTYPES}")
+        self.dtype = dtype
+        self.quantize = quantize
+        self.threads = threads
+        self.compile = compile
+
+    def weights_dtype(self):
+        # dynamic quantization only converts float32 weights
+        return "fp32" if self.quantize else self.dtype
+
+    def torch_dtype(self):
+        import torch
+
+        if self.weights_dtype() == "fp32":
+            return torch.float32
+        return torch.bfloat16
+
+    def describe(self):
+        """The weights this config produces, anything that changes the model's output"""
+        if self.quantize:
+            return "fp32+qint8"
+        return self.dtype
+
+    def apply_threads(self):
+        import torch
+
+        if self.threads:
+            torch.set_num_threads(self.threads)
+
+    def apply(self, model):
+        import torch
+
+        if self.quantize:
+            model = torch.ao.quantization.quantize_dynamic(
+                model, {torch.nn.Linear}, dtype=torch.qint8
+            )
+        if self.compile:
+            # shapes change every decode step, so compile once for dynamic shapes
+            model.forward = torch.compile(model.forward, dynamic=True)
+        # kept on the config so cached key/values are never shared across variants
+        model.config.think_inference = self.describe()
+        return model
+
+
+inference_config = InferenceConfig()
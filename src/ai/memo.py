@@ -0,0 +1,52 @@
+#######################################
+# THINK MEMOIZATION
+#######################################
+
+from ..consts import THINK_ONCE, THINK_DISTINCT, THINK_ALWAYS
+from .stats import memo_stats
+
+# distinct prompts a single call site remembers, the oldest is dropped first
+MEMO_MAX_PROMPTS = 64
+
+
+class ThinkMemo:
+    """
+    Code every think call site already got, kept on its ThinkNode so a think in a
+    loop body or a function does not generate again on every evaluation. 'once'
+    keeps the first code whatever the prompt, 'distinct' keeps one code per
+    prompt and 'always' generates fresh code every time
+    """
+
+    __slots__ = ("default_policy",)
+
+    def __init__(self, default_policy=THINK_DISTINCT):
+        self.default_policy = default_policy
+
+    def policy_of(self, node):
+        return node.policy or self.default_policy
+
+    def lookup(self, node, prompt):
+        policy = self.policy_of(node)
+        if policy == THINK_ALWAYS:
+            code = None
+        elif policy == THINK_ONCE:
+            code = node.memo.get(THINK_ONCE)
+        else:
+            code = node.memo.get(prompt)
+        memo_stats.record(policy, code is not None)
+        return code
+
+    def store(self, node, prompt, code):
+        policy = self.policy_of(node)
+        if policy == THINK_ALWAYS:
+            return
+        if policy == THINK_ONCE:
+            node.memo[THINK_ONCE] = code
+            return
+
+        node.memo[prompt] = code
+        if len(node.memo) > MEMO_MAX_PROMPTS:
+            del node.memo[next(iter(node.memo))]
+
+
+think_memo = ThinkMemo()
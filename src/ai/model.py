@@ -0,0 +1,133 @@
+#######################################
+# MODEL HOLDER
+#######################################
+
+import os
+
+from rich.console import Console
+
+from .inference import inference_config
+
+console = Console()
+
+model_name = "deepseek-ai/deepseek-coder-1.3b-instruct"
+model_revision = "main"
+
+# one download shared by every working directory, THINKLANG_MODELS moves it
+MODELS_DIR = os.environ.get(
+    "THINKLANG_MODELS",
+    os.path.join(os.path.expanduser("~"), ".cache", "thinklang", "models"),
+)
+
+
+class LazyModel:
+    """
+    Holds the tokenizer and model, only loading them the first time they are needed.
+    Models come from the shared models directory first and are only downloaded when
+    missing there, never when offline. A checkpoint converted ahead of time with
+    convert() is used instead of the original whenever one exists
+    """
+
+    __slots__ = (
+        "name",
+        "revision",
+        "config",
+        "models_dir",
+        "offline",
+        "tokenizer",
+        "model",
+        "enabled",
+    )
+
+    def __init__(self, name, revision="main", config=inference_config):
+        self.name = name
+        self.revision = revision
+        self.config = config
+        self.models_dir = MODELS_DIR
+        self.offline = False
+        self.tokenizer = None
+        self.model = None
+        self.enabled = True
+
+    @property
+    def loaded(self):
+        return self.model is not None
+
+    def converted_path(self):
+        """Where convert() puts the checkpoint for the current dtype"""
+        name = self.name.strip("/").replace("/", "--")
+        return os.path.join(
+            self.models_dir,
+            "converted",
+            f"{name}@{self.revision}-{self.config.weights_dtype()}",
+        )
+
+    def from_pretrained(self, cls, source, **kwargs):
+        if os.path.isdir(source):
+            return cls.from_pretrained(source, **kwargs)
+
+        kwargs.update(revision=self.revision, cache_dir=self.models_dir)
+        try:
+            # no round trip to the hub when the files are already here
+            return cls.from_pretrained(source, local_files_only=True, **kwargs)
+        except OSError:
+            if self.offline:
+                raise
+        return cls.from_pretrained(source, **kwargs)
+
+    def load_pretrained(self, source):
+        # heavy imports are deferred so scripts without 'think' never pay for them
+        from transformers import AutoTokenizer, AutoModelForCausalLM
+
+        tokenizer = self.from_pretrained(AutoTokenizer, source, trust_remote_code=True)
+        # safetensors are memory mapped, and the weights are not materialized
+        # twice on the way into the model
+        model = self.from_pretrained(
+            AutoModelForCausalLM,
+            source,
+            trust_remote_code=True,
+            torch_dtype=self.config.torch_dtype(),
+            low_cpu_mem_usage=True,
+            use_safetensors=True,
+        )
+        return tokenizer, model
+
+    def load(self):
+        if self.loaded:
+            return self.tokenizer, self.model
+
+        converted = self.converted_path()
+        source = converted if os.path.isdir(converted) else self.name
+
+        self.config.apply_threads()
+        with console.status(
+            "Importing the brains behind this stupid language (Deepseek lol)..."
+        ) as status:
+            self.tokenizer, model = self.load_pretrained(source)
+            self.model = self.config.apply(model)
+        return self.tokenizer, self.model
+
+    def convert(self):
+        """
+        Saves the model in the dtype it runs in, so later loads map it straight
+        from disk without converting. Quantization still happens when loading
+        """
+        with console.status(
+            "Converting the brains behind this stupid language..."
+        ) as status:
+            tokenizer, model = self.load_pretrained(self.name)
+            path = self.converted_path()
+            model.save_pretrained(path, safe_serialization=True)
+            tokenizer.save_pretrained(path)
+        return path
+
+    def disable(self):
+        self.enabled = False
+
+
+brain = LazyModel(model_name, model_revision)
+
+
+def preload():
+    """Load the model now instead of on the first 'think'"""
+    return brain.load()
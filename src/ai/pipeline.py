@@ -0,0 +1,188 @@
+#######################################
+# THINK PIPELINE
+#######################################
+
+import queue
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future
+
+from ..consts import THINK_ALWAYS
+from ..lib.nodes import (
+    ThinkNode,
+    StringNode,
+    NumberNode,
+    VarAccessNode,
+    VarAssignNode,
+    BinOpNode,
+    UnaryOpNode,
+    ForNode,
+    FuncDefNode,
+    walk,
+)
+from .memo import think_memo
+
+# prompts built only from these can be evaluated early without side effects
+PURE_NODES = (StringNode, NumberNode, VarAccessNode, BinOpNode, UnaryOpNode)
+# finished generations kept for thinks that have not been reached yet
+MAX_FINISHED = 256
+
+
+def assigned_names(node):
+    names = set()
+    for child in walk(node):
+        if isinstance(child, (VarAssignNode, ForNode)):
+            names.add(child.var_name_tok.value)
+        elif isinstance(child, FuncDefNode) and child.var_name_tok:
+            names.add(child.var_name_tok.value)
+    return names
+
+
+class ThinkPlan:
+    """
+    The think statements of a statement list, and the names every statement
+    assigns. A think can be submitted once none of the statements still to run
+    before it assign a variable its prompt reads. Thinks with the 'always'
+    policy generate fresh code when they run, so they are never planned
+    """
+
+    __slots__ = ("thinks", "assigned")
+
+    def __init__(self, statements):
+        self.thinks = []
+        self.assigned = [assigned_names(statement) for statement in statements]
+
+        for idx, statement in enumerate(statements):
+            if not isinstance(statement, ThinkNode) or not statement.node_to_think:
+                continue
+            if think_memo.policy_of(statement) == THINK_ALWAYS:
+                continue
+            prompt_nodes = list(walk(statement.node_to_think))
+            if not all(isinstance(node, PURE_NODES) for node in prompt_nodes):
+                continue
+            reads = {
+                node.var_name_tok.value
+                for node in prompt_nodes
+                if isinstance(node, VarAccessNode)
+            }
+            self.thinks.append((idx, statement, reads))
+
+    def ready(self, current_idx):
+        """Pops the thinks whose prompts no longer depend on pending statements"""
+        ready = []
+        for think in list(self.thinks):
+            idx, statement, reads = think
+            if idx < current_idx:
+                self.thinks.remove(think)
+                continue
+            if any(reads & names for names in self.assigned[current_idx:idx]):
+                continue
+            self.thinks.remove(think)
+            ready.append(statement)
+        return ready
+
+
+class ThinkPipeline:
+    """
+    Generates think code on a background thread while the interpreter keeps
+    running earlier statements. A think statement only blocks on the result
+    when execution actually reaches it
+    """
+
+    __slots__ = ("batch_fn", "chunk_size", "futures", "queue", "worker", "lock")
+
+    def __init__(self):
+        self.batch_fn = None
+        self.chunk_size = 1
+        self.futures = OrderedDict()
+        self.queue = queue.Queue()
+        self.worker = None
+        self.lock = threading.Lock()
+
+    @property
+    def running(self):
+        return self.worker is not None
+
+    def start(self, batch_fn, chunk_size=1):
+        """
+        Starts generating on the worker with batch_fn, at most chunk_size prompts
+        at a time so the first thinks of a long script do not wait on the rest
+        """
+        if self.running:
+            return
+        self.batch_fn = batch_fn
+        self.chunk_size = max(1, chunk_size)
+        # daemon, so exiting never waits on a generation nobody needs anymore
+        self.worker = threading.Thread(
+            target=self.work, name="think-pipeline", daemon=True
+        )
+        self.worker.start()
+
+    def work(self):
+        while True:
+            prompts, futures = self.queue.get()
+            try:
+                results = self.batch_fn(prompts)
+            except BaseException as e:
+                # whoever waits still gets the error, the next think tries again
+                with self.lock:
+                    for prompt, future in zip(prompts, futures):
+                        if self.futures.get(prompt) is future:
+                            del self.futures[prompt]
+                for future in futures:
+                    future.set_exception(e)
+                continue
+            for prompt, future in zip(prompts, futures):
+                future.set_result(results[prompt])
+
+    def submit(self, prompts):
+        """
+        The future of every prompt, generations are only queued for new ones. They
+        are queued in chunks in the order given, each chunk's futures resolve as
+        soon as that chunk is generated
+        """
+        with self.lock:
+            futures = {}
+            pending = []
+            for prompt in dict.fromkeys(prompts):
+                if prompt not in self.futures:
+                    self.futures[prompt] = Future()
+                    pending.append(prompt)
+                futures[prompt] = self.futures[prompt]
+            self.evict()
+
+        for start in range(0, len(pending), self.chunk_size):
+            chunk = pending[start : start + self.chunk_size]
+            self.queue.put((chunk, [futures[prompt] for prompt in chunk]))
+        return futures
+
+    def evict(self):
+        # oldest finished generations first, pending ones still have a think to serve
+        finished = len(self.futures) - MAX_FINISHED
+        for prompt, future in list(self.futures.items()):
+            if finished <= 0:
+                break
+            if future.done():
+                del self.futures[prompt]
+                finished -= 1
+
+    def done(self, prompt):
+        """Whether the code for a prompt was already generated successfully"""
+        with self.lock:
+            future = self.futures.get(prompt)
+        return future is not None and future.done() and future.exception() is None
+
+    def result(self, prompt):
+        return self.submit([prompt])[prompt].result()
+
+    def look_ahead(self, plan, current_idx, interpreter, context):
+        prompts = []
+        for statement in plan.ready(current_idx):
+            value = interpreter.visit(statement.node_to_think, context)
+            if value.error:
+                continue
+            prompts.append(str(value.value))
+        self.submit(prompts)
+
+
+think_pipeline = ThinkPipeline()
@@ -0,0 +1,71 @@
+#######################################
+# PRECOMPILED THINK BODIES
+#######################################
+
+import os
+import json
+
+from ..consts import VERSION
+from .model import brain
+from .backends import MODEL_BACKENDS
+
+
+def sidecar_path(script_path):
+    return script_path + ".json"
+
+
+class Precompiled:
+    """
+    Think bodies generated ahead of time by 'think.py --compile', keyed by the
+    prompt text. A hit means the model is never touched for that prompt
+    """
+
+    __slots__ = ("bodies", "source")
+
+    def __init__(self):
+        self.bodies = {}
+        self.source = None
+
+    def load(self, script_path):
+        """
+        Takes the bodies of the script's sidecar if it has one. A sidecar compiled
+        by another version, for another model or revision or not by the model is
+        not used, why is returned then so it can be shown
+        """
+        path = sidecar_path(script_path)
+        if not os.path.isfile(path):
+            return None
+
+        with open(path, "r") as f:
+            sidecar = json.load(f)
+        made_for = (
+            sidecar.get("version"),
+            sidecar.get("model"),
+            sidecar.get("revision"),
+        )
+        if made_for != (VERSION, brain.name, brain.revision):
+            version, model, revision = made_for
+            return (
+                f"Ignoring {path}, it was compiled by version {version} for "
+                f"{model}@{revision}, compile it again for {brain.name}@{brain.revision}"
+            )
+
+        backends = sidecar.get("backends")
+        if not backends or not all(name in MODEL_BACKENDS for name in backends):
+            return (
+                f"Ignoring {path}, it was not generated by the model, "
+                f"compile it again for {brain.name}@{brain.revision}"
+            )
+
+        self.bodies.update(sidecar.get("thinks", {}))
+        self.source = path
+        return None
+
+    def get(self, prompt):
+        return self.bodies.get(prompt)
+
+    def has(self, prompt):
+        return prompt in self.bodies
+
+
+precompiled = Precompiled()
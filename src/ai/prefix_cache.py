@@ -0,0 +1,153 @@
+#######################################
+# PREFIX KV CACHE
+#######################################
+
+import os
+import hashlib
+from contextlib import contextmanager
+
+from .cache import touch, evict_lru
+
+PREFIX_CACHE_DIR = os.path.join(os.getcwd(), "cache/prefix")
+# a preamble's key/values take hundreds of MB, this keeps a few models' worth
+PREFIX_CACHE_MAX_BYTES = 1024 * 1024 * 1024
+
+
+class PrefixCache:
+    """
+    Keeps the attention key/values of the shared syntax preamble so each think
+    call only has to prefill its own prompt. The cache lives as long as the
+    interpreter and can optionally be written to disk for the next process. Files
+    on disk are evicted least recently used first once they grow past max_bytes
+    """
+
+    __slots__ = (
+        "directory",
+        "persist",
+        "max_bytes",
+        "key",
+        "cache",
+        "length",
+        "hits",
+        "misses",
+        "evictions",
+    )
+
+    def __init__(
+        self,
+        directory=PREFIX_CACHE_DIR,
+        persist=False,
+        max_bytes=PREFIX_CACHE_MAX_BYTES,
+    ):
+        self.directory = directory
+        self.persist = persist
+        self.max_bytes = max_bytes
+        self.key = None
+        self.cache = None
+        self.length = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @staticmethod
+    def make_key(model_name, revision, model, prefix_ids):
+        digest = hashlib.sha256()
+        variant = getattr(model.config, "think_inference", model.dtype)
+        digest.update(f"{model_name}@{revision}:{variant}:".encode("utf-8"))
+        digest.update(",".join(map(str, prefix_ids)).encode("utf-8"))
+        return digest.hexdigest()
+
+    def entry_path(self, key):
+        return os.path.join(self.directory, key + ".pt")
+
+    def load_from_disk(self, key):
+        import torch
+        from transformers import DynamicCache
+
+        path = self.entry_path(key)
+        try:
+            legacy = torch.load(path, weights_only=True)
+        except (OSError, RuntimeError):
+            return None
+
+        touch(path)
+        return DynamicCache.from_legacy_cache(legacy)
+
+    def save_to_disk(self, key, cache):
+        import torch
+
+        os.makedirs(self.directory, exist_ok=True)
+        path = self.entry_path(key)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        torch.save(cache.to_legacy_cache(), tmp_path)
+        os.replace(tmp_path, path)
+        self.evict(keep=path)
+
+    def evict(self, keep=None):
+        # the preamble just written is the one in use, even if it alone is too big
+        self.evictions += evict_lru(self.directory, ".pt", self.max_bytes, keep)
+
+    def prefill(self, model, prefix_ids):
+        import torch
+
+        with torch.no_grad():
+            outputs = model(
+                torch.tensor([prefix_ids], device=model.device), use_cache=True
+            )
+        return outputs.past_key_values
+
+    def get(self, model_name, revision, model, prefix_ids):
+        key = self.make_key(model_name, revision, model, prefix_ids)
+        if key == self.key:
+            self.hits += 1
+            return self.cache
+
+        self.misses += 1
+        cache = self.load_from_disk(key) if self.persist else None
+        if cache is None:
+            cache = self.prefill(model, prefix_ids)
+            if self.persist:
+                self.save_to_disk(key, cache)
+
+        self.key = key
+        self.cache = cache
+        self.length = len(prefix_ids)
+        return cache
+
+    @contextmanager
+    def borrow(self, model_name, revision, model, prefix_ids):
+        """
+        Lends out the preamble cache for a single generate call. Generation appends
+        to it in place, so it is cropped back to the preamble afterwards
+        """
+        cache = self.get(model_name, revision, model, prefix_ids)
+        try:
+            yield cache
+        finally:
+            cache.crop(self.length)
+
+    def expand(self, model_name, revision, model, prefix_ids, batch_size):
+        """
+        A fresh cache holding the preamble once per batch row. The rows are views
+        of the shared tensors, so the shared cache is neither copied nor modified
+        """
+        from transformers import DynamicCache
+
+        cache = self.get(model_name, revision, model, prefix_ids)
+        return DynamicCache.from_legacy_cache(
+            tuple(
+                (
+                    key.expand(batch_size, -1, -1, -1),
+                    value.expand(batch_size, -1, -1, -1),
+                )
+                for key, value in cache.to_legacy_cache()
+            )
+        )
+
+    def clear(self):
+        self.key = None
+        self.cache = None
+        self.length = 0
+
+
+prefix_cache = PrefixCache()
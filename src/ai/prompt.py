@@ -0,0 +1,180 @@
+#######################################
+# PROMPT CONTEXT
+#######################################
+
+import os
+import hashlib
+
+from .retrieval import SnippetIndex
+
+EXAMPLES_PATH = os.path.join(os.getcwd(), "examples")
+STD_MATH_PATH = os.path.join(os.getcwd(), "src/std/math.think")
+
+INSTRUCT_TEMPLATE = """You are a software developer writing code in a new language. The language syntax is shown below:
+        {training_codes}
+
+        You are to code in this langauge using this syntax. Write just the source code without any explanation. Keep all the source code inside triple backticks (`).
+        
+        Prompt:{prompt}"""
+
+# stand in for the examples and the user prompt while the chat template is split
+CONTEXT_SENTINEL = "\x00THINK_CONTEXT\x00"
+PROMPT_SENTINEL = "\x00THINK_PROMPT\x00"
+
+
+def example_sources():
+    sources = [os.path.join(EXAMPLES_PATH, f) for f in os.listdir(EXAMPLES_PATH)]
+    sources.append(STD_MATH_PATH)
+    return sources
+
+
+class PromptContext:
+    """
+    Builds the few-shot syntax preamble once per process and keeps it tokenized.
+    The sources are re-read only when one of their mtimes changes, and the tokens
+    are thrown away only when the re-read text actually hashes differently.
+
+    With retrieval enabled the examples are picked per prompt instead, and only
+    the instructions before them are shared between calls
+    """
+
+    __slots__ = (
+        "sources_fn",
+        "signature",
+        "text",
+        "hash",
+        "tokenizer",
+        "prefix_ids",
+        "suffix_text",
+        "context_head",
+        "context_tail",
+        "retrieval",
+        "index",
+        "last_prompt_tokens",
+    )
+
+    def __init__(self, sources_fn=example_sources):
+        self.sources_fn = sources_fn
+        self.signature = None
+        self.text = ""
+        self.hash = None
+        self.tokenizer = None
+        self.prefix_ids = None
+        self.suffix_text = None
+        self.context_head = None
+        self.context_tail = None
+        # (top_k, token_budget) of the snippets picked per prompt, None for all
+        self.retrieval = None
+        self.index = None
+        self.last_prompt_tokens = None
+
+    def enable_retrieval(self, top_k=8, token_budget=1024):
+        self.retrieval = (top_k, token_budget)
+        self.prefix_ids = None
+
+    def stat_sources(self):
+        signature = []
+        for source in self.sources_fn():
+            try:
+                signature.append((source, os.stat(source).st_mtime_ns))
+            except OSError:
+                continue
+        return tuple(signature)
+
+    def refresh(self):
+        signature = self.stat_sources()
+        if signature == self.signature:
+            return self
+
+        # map them into a single string and feed that into the model as context
+        training_codes = ""
+        for code_loc, _ in signature:
+            with open(code_loc) as f:
+                training_codes += f.read()
+                training_codes += "\n"
+
+        text_hash = hashlib.sha256(training_codes.encode("utf-8")).hexdigest()
+        if text_hash != self.hash:
+            self.text = training_codes
+            self.hash = text_hash
+            self.prefix_ids = None
+            self.index = None
+        self.signature = signature
+        return self
+
+    def training_codes(self, prompt, count_tokens=None):
+        self.refresh()
+        if self.retrieval is None:
+            return self.text
+
+        if self.index is None:
+            self.index = SnippetIndex(self.text)
+        top_k, token_budget = self.retrieval
+        # without a tokenizer at hand, four characters a token is close enough
+        count_tokens = count_tokens or (lambda text: len(text) // 4)
+        return self.index.select(prompt, top_k, token_budget, count_tokens)
+
+    def render(self, prompt):
+        return INSTRUCT_TEMPLATE.format(
+            training_codes=self.training_codes(prompt), prompt=f" {prompt}"
+        )
+
+    def tokenize_prefix(self, tokenizer):
+        self.refresh()
+        if self.prefix_ids is not None and self.tokenizer is tokenizer:
+            return self.prefix_ids
+
+        # render the chat template around sentinels and split it, everything up to
+        # "Prompt:" is identical for every call and only has to be tokenized once
+        content = INSTRUCT_TEMPLATE.format(
+            training_codes=CONTEXT_SENTINEL, prompt=" " + PROMPT_SENTINEL
+        )
+        templated = tokenizer.apply_chat_template(
+            [{"role": "user", "content": content}],
+            add_generation_prompt=True,
+            tokenize=False,
+        )
+        head, rest = templated.split(CONTEXT_SENTINEL, 1)
+        middle, self.suffix_text = rest.split(" " + PROMPT_SENTINEL, 1)
+
+        if self.retrieval is None:
+            prefix_text = head + self.text + middle
+        else:
+            # the picked examples differ per prompt, so the shared part ends at
+            # the line they start on
+            cut = head.rfind("\n") + 1
+            prefix_text = head[:cut]
+            self.context_head = head[cut:]
+            self.context_tail = middle
+
+        self.prefix_ids = tokenizer(prefix_text, add_special_tokens=False).input_ids
+        self.tokenizer = tokenizer
+        return self.prefix_ids
+
+    def encode(self, tokenizer, prompt):
+        """Token ids for the full chat prompt, reusing the tokenized preamble"""
+        prefix_ids = self.tokenize_prefix(tokenizer)
+        text = f" {prompt}" + self.suffix_text
+
+        if self.retrieval is not None:
+            training_codes = self.training_codes(
+                prompt,
+                lambda snippet: len(
+                    tokenizer(snippet, add_special_tokens=False).input_ids
+                ),
+            )
+            text = self.context_head + training_codes + self.context_tail + text
+
+        prompt_ids = prefix_ids + tokenizer(text, add_special_tokens=False).input_ids
+        self.last_prompt_tokens = len(prompt_ids)
+        return prompt_ids
+
+    @property
+    def token_count(self):
+        """Preamble tokens every think call pays for, None until first tokenized"""
+        if self.prefix_ids is None:
+            return None
+        return len(self.prefix_ids)
+
+
+prompt_context = PromptContext()
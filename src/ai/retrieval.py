@@ -0,0 +1,82 @@
+#######################################
+# SNIPPET RETRIEVAL
+#######################################
+
+import re
+import math
+from collections import Counter
+
+WORD = re.compile(r"[A-Za-z_][A-Za-z0-9_]*")
+BLANK_LINES = re.compile(r"\n\s*\n")
+
+
+def words(text):
+    return [word.lower() for word in WORD.findall(text)]
+
+
+def split_snippets(text):
+    """Blank line separated blocks, the way the examples group their code"""
+    return [block.strip("\n") for block in BLANK_LINES.split(text) if block.strip()]
+
+
+class SnippetIndex:
+    """
+    BM25 over the keywords and identifiers of the example snippets, so a think
+    prompt only carries the syntax examples that look relevant to it
+    """
+
+    __slots__ = ("snippets", "terms", "lengths", "document_freq", "average_length")
+
+    k1 = 1.5
+    b = 0.75
+
+    def __init__(self, text):
+        self.snippets = split_snippets(text)
+        self.terms = [Counter(words(snippet)) for snippet in self.snippets]
+        self.lengths = [sum(terms.values()) for terms in self.terms]
+        self.document_freq = Counter()
+        for terms in self.terms:
+            self.document_freq.update(terms.keys())
+        self.average_length = (
+            sum(self.lengths) / len(self.lengths) if self.lengths else 0
+        )
+
+    def idf(self, word):
+        count = self.document_freq.get(word, 0)
+        total = len(self.snippets)
+        return math.log((total - count + 0.5) / (count + 0.5) + 1)
+
+    def score(self, query_words, idx):
+        terms = self.terms[idx]
+        norm = self.k1 * (
+            1 - self.b + self.b * self.lengths[idx] / (self.average_length or 1)
+        )
+        score = 0.0
+        for word in query_words:
+            freq = terms.get(word, 0)
+            if freq:
+                score += self.idf(word) * freq * (self.k1 + 1) / (freq + norm)
+        return score
+
+    def select(self, query, top_k, token_budget, count_tokens):
+        """
+        Best scoring snippets for the query, at most top_k of them, and only as
+        many as fit in token_budget. They keep their order from the sources
+        """
+        query_words = set(words(query))
+        ranked = sorted(
+            range(len(self.snippets)),
+            key=lambda idx: self.score(query_words, idx),
+            reverse=True,
+        )
+
+        chosen = []
+        used = 0
+        for idx in ranked[:top_k]:
+            cost = count_tokens(self.snippets[idx])
+            if used + cost > token_budget:
+                continue
+            chosen.append(idx)
+            used += cost
+
+        return "\n\n".join(self.snippets[idx] for idx in sorted(chosen)) + "\n"
@@ -0,0 +1,196 @@
+#######################################
+# THINK STATISTICS
+#######################################
+
+import json
+import threading
+from collections import OrderedDict, deque
+
+from .cache import code_cache
+
+# calls each of the stats keeps, their totals count all of them
+MAX_RECENT_CALLS = 256
+
+
+class DecodeStats:
+    """Decode steps per generation, and how many the code fence stop saved"""
+
+    __slots__ = ("calls", "steps_saved", "lock")
+
+    def __init__(self):
+        self.calls = deque(maxlen=MAX_RECENT_CALLS)
+        self.steps_saved = 0
+        self.lock = threading.Lock()
+
+    def record(self, prompt, steps, budget, stopped_at_fence):
+        saved = budget - steps if stopped_at_fence else 0
+        with self.lock:
+            self.calls.append(
+                {
+                    "prompt": prompt,
+                    "steps": steps,
+                    "budget": budget,
+                    "saved": saved,
+                }
+            )
+            self.steps_saved += saved
+        return saved
+
+
+decode_stats = DecodeStats()
+
+
+class ValidationStats:
+    """Generate calls each think needed before its code lexed and parsed"""
+
+    __slots__ = ("calls", "thinks", "attempts", "lock")
+
+    def __init__(self):
+        self.calls = deque(maxlen=MAX_RECENT_CALLS)
+        self.thinks = 0
+        self.attempts = 0
+        self.lock = threading.Lock()
+
+    def record(self, prompt, attempts, failures, valid):
+        with self.lock:
+            self.calls.append(
+                {
+                    "prompt": prompt,
+                    "attempts": attempts,
+                    "failures": failures,
+                    "valid": valid,
+                }
+            )
+            self.thinks += 1
+            self.attempts += attempts
+
+    @property
+    def mean_attempts(self):
+        if not self.thinks:
+            return 0
+        return self.attempts / self.thinks
+
+
+validation_stats = ValidationStats()
+
+
+class MemoStats:
+    """Think evaluations per memoization policy, and how many reused earlier code"""
+
+    __slots__ = ("policies",)
+
+    def __init__(self):
+        self.policies = {}
+
+    def record(self, policy, reused):
+        counts = self.policies.setdefault(
+            policy, {"thinks": 0, "generated": 0, "saved": 0}
+        )
+        counts["thinks"] += 1
+        counts["saved" if reused else "generated"] += 1
+
+    @property
+    def saved(self):
+        return sum(counts["saved"] for counts in self.policies.values())
+
+
+memo_stats = MemoStats()
+
+
+# what a generation costs, added up per prompt until its think finishes
+GENERATION_FIELDS = (
+    "prompt_tokens",
+    "generated_tokens",
+    "steps_saved",
+    "prefill_seconds",
+    "decode_seconds",
+    "validation_attempts",
+    "validation_failures",
+)
+# sources that hand over code without generating anything
+CACHED_SOURCES = ("memo", "precompiled", "cache")
+# prompts generated for but not asked for by a think yet, the oldest is dropped
+MAX_PENDING_PROMPTS = 256
+
+
+class ThinkStats:
+    """
+    What every think evaluation cost: where its code came from, the prompt and
+    generated tokens, the decode steps the code fence stop saved, prefill and
+    decode time and how many generate calls it took until the code parsed and
+    how many of those failed. Generation is noted per prompt as it happens, often
+    on another thread, and becomes part of a call once the think that asked for
+    it is done. Thinks generated in one batch each count the time of the whole
+    batch. Only the most recent calls are kept, the totals count every one
+    """
+
+    __slots__ = ("calls", "totals", "pending", "lock")
+
+    def __init__(self):
+        self.calls = deque(maxlen=MAX_RECENT_CALLS)
+        self.totals = dict.fromkeys(
+            ("thinks", "cache_hits", "seconds", *GENERATION_FIELDS), 0
+        )
+        self.pending = OrderedDict()
+        self.lock = threading.Lock()
+
+    def entry(self, prompt):
+        entry = self.pending.get(prompt)
+        if entry is None:
+            entry = self.pending[prompt] = {"source": None}
+            if len(self.pending) > MAX_PENDING_PROMPTS:
+                self.pending.popitem(last=False)
+        return entry
+
+    def note_source(self, prompt, source):
+        with self.lock:
+            self.entry(prompt)["source"] = source
+
+    def add(self, prompt, **counts):
+        with self.lock:
+            entry = self.entry(prompt)
+            for field, value in counts.items():
+                entry[field] = entry.get(field, 0) + value
+
+    def record(self, prompt, seconds, source=None):
+        """A think is done, with everything noted for its prompt since the last one"""
+        with self.lock:
+            entry = self.pending.pop(prompt, {"source": None})
+        source = source or entry["source"] or "unknown"
+        call = {
+            "prompt": prompt,
+            "source": source,
+            "cache_hit": source in CACHED_SOURCES,
+            "seconds": seconds,
+        }
+        for field in GENERATION_FIELDS:
+            call[field] = entry.get(field, 0)
+
+        with self.lock:
+            self.calls.append(call)
+            self.totals["thinks"] += 1
+            self.totals["cache_hits"] += call["cache_hit"]
+            self.totals["seconds"] += seconds
+            for field in GENERATION_FIELDS:
+                self.totals[field] += call[field]
+
+    def summary(self):
+        with self.lock:
+            summary = dict(self.totals)
+        summary["mean_attempts"] = validation_stats.mean_attempts
+        for name, count in code_cache.stats().items():
+            summary[f"code_cache_{name}"] = count
+        # what each memoization policy generated and saved, e.g. memo_distinct_saved
+        for policy, counts in list(memo_stats.policies.items()):
+            for name, count in counts.items():
+                summary[f"memo_{policy}_{name}"] = count
+        return summary
+
+    def dump(self, path):
+        with self.lock:
+            calls = list(self.calls)
+        with open(path, "w") as f:
+            json.dump({"summary": self.summary(), "calls": calls}, f, indent=2)
+
+
+think_stats = ThinkStats()
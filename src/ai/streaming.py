@@ -0,0 +1,142 @@
+#######################################
+# STREAMED THINK CODE
+#######################################
+
+from rich.console import Console
+
+from ..lib.lex import Lexer, lex_step, LS_CODE, LS_ILLEGAL
+from ..lib.parser import Parser
+from ..lib.utils import source_buffer
+from .ast_cache import THINK_FN
+
+console = Console()
+
+BLOCK_END = "end\n"
+
+# set by --stream, run generated code while the model is still writing it
+enabled = False
+
+
+def lex_state(text):
+    """The state the lexer is left in after the text, LS_CODE outside any string"""
+    state = LS_CODE
+    for char in text:
+        state = lex_step(state, char)
+        if state == LS_ILLEGAL:
+            break
+    return state
+
+
+def compile_code(code):
+    """The statements or the error of a piece of code, and the source it was lexed as"""
+    lexer = Lexer(THINK_FN, code)
+    ast = Parser(lexer.generate_tokens()).parse()
+    if lexer.error:
+        return None, lexer.error, lexer.source
+    if ast.error:
+        return None, ast.error, lexer.source
+    return ast.node, None, lexer.source
+
+
+def parse_code(code):
+    """The statements of a piece of code and None, or None and its error"""
+    statements, error, _ = compile_code(code)
+    return statements, error
+
+
+class StatementStream:
+    """
+    Generated code as it arrives, cut into pieces that can run on their own.
+    Only whole lines are looked at, and they are held back until they end outside
+    of any string, parse and leave no block open, so a block runs as soon as its
+    `end` is written
+    """
+
+    __slots__ = ("code", "pending", "statements")
+
+    def __init__(self):
+        self.code = ""
+        self.pending = ""
+        # top level statements handed out so far
+        self.statements = 0
+
+    def feed(self, chunk):
+        """The statements that became complete with this chunk, None if none did"""
+        self.code += chunk
+        self.pending += chunk
+
+        cut = self.pending.rfind("\n") + 1
+        ready = self.pending[:cut]
+        if not ready.strip():
+            self.pending = self.pending[cut:]
+            return None
+        if lex_state(ready) != LS_CODE:
+            return None
+
+        # an open block is retried with the next line. Some blocks parse without
+        # their `end` too, they are still open if an `end` would close them
+        # attempts that are never run are dropped from the source buffer again
+        statements, error, source = compile_code(ready)
+        if error:
+            source_buffer.discard(source)
+            return None
+        _, error, probe = compile_code(ready + BLOCK_END)
+        source_buffer.discard(probe)
+        if error is None:
+            source_buffer.discard(source)
+            return None
+        self.pending = self.pending[cut:]
+        self.statements += len(statements.element_nodes)
+        return statements
+
+    def finish(self):
+        """
+        Whatever is left once the model is done, it has to parse now. Returns
+        its statements (None if nothing is left) and its error
+        """
+        rest, self.pending = self.pending, ""
+        if not rest.strip():
+            return None, None
+        statements, error = parse_code(rest)
+        if statements is not None:
+            self.statements += len(statements.element_nodes)
+        return statements, error
+
+
+class StreamProgress:
+    """
+    A status line while waiting for the model, paused whenever streamed code runs
+    so the program's own output and input are not drawn over
+    """
+
+    __slots__ = ("prompt", "status")
+
+    def __init__(self, prompt):
+        self.prompt = prompt
+        self.status = console.status(self.text(None))
+
+    def text(self, stream):
+        text = (
+            "Running spagetti code while it is being written lol...\n"
+            + f"Your prompt: [blue underline]{self.prompt}[/]"
+        )
+        if stream is not None:
+            lines = stream.code.count("\n")
+            text += f"\n{lines} lines written, {stream.statements} statements run"
+        return text
+
+    def update(self, stream):
+        self.status.update(self.text(stream))
+
+    def pause(self):
+        self.status.stop()
+
+    def resume(self):
+        self.status.start()
+
+    def __enter__(self):
+        self.status.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.status.stop()
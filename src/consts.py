@@ -69,6 +69,13 @@ KEYWORDS = [
     "think",
 ]
 
+# words that can follow 'think' to choose how its code is memoized, they are
+# only taken as a policy when a prompt follows them
+THINK_ONCE = "once"
+THINK_DISTINCT = "distinct"
+THINK_ALWAYS = "always"
+THINK_POLICIES = [THINK_ONCE, THINK_DISTINCT, THINK_ALWAYS]
+
 helpMsg = """help - [
             <builtin function>:
                 help - print this message
@@ -106,6 +113,9 @@ helpMsg = """help - [
                 rand_pick(list) - pick a random item from a list: list -> any
                 run(string) - run a ThinkLang file: Run("file_name")
                 error(message) - raise an runtime error: string -> null
+                think_async(prompt) - start generating code for a prompt in the background: string -> handle
+                await_think(handle) - wait for a think_async and run its code: handle -> any
+                think_stats - get what every think so far cost, as [name, value] pairs: -> list
             <builtin types>:
                 int - integer : 123
                 string - string : "hello"
@@ -272,6 +282,21 @@ help_dict = {
         "text": "raise an runtime error with message",
         "returns": "null",
     },
+    "think_async": {
+        "args": "string",
+        "text": "start generating code for a prompt in the background",
+        "returns": "handle",
+    },
+    "await_think": {
+        "args": "handle",
+        "text": "wait for a think_async to finish and run its code, like think would",
+        "returns": "any",
+    },
+    "think_stats": {
+        "args": "",
+        "text": "get the thinks so far, cache hits, prompt and generated tokens, prefill and decode seconds and validation failures, as [name, value] pairs",
+        "returns": "list",
+    },
     "<builtin types>": {
         "int": "integer",
         "string": "string",
@@ -5,7 +5,17 @@
 import os
 import time
 import random
-from .ai.generate_code import generate_code
+from .ai.generate_code import generate_code, think_code, think_code_stream
+from .ai.model import brain
+from .ai.precompiled import precompiled
+from .ai.pipeline import think_pipeline, ThinkPlan
+from .ai.backends import BackendUnavailable
+from .ai.ast_cache import think_asts
+from .ai.memo import think_memo
+from .ai.async_pool import think_pool
+from .ai.stats import think_stats
+from .ai import streaming
+from .ai.streaming import StatementStream, StreamProgress
 from .lib.parser import Parser
 
 from .consts import *
@@ -21,7 +31,7 @@ from .lib.nodes import *
 from .lib.parsing_types import *
 from .lib.lex import Lexer, RTResult
 from .lib.parsing_types import *
-from .lib.utils import Token
+from .lib.utils import Token, source_buffer
 import os
 from pathlib import Path
 
@@ -44,14 +54,14 @@ def import_module(fn, interpreter, context):
     with open(fn, "r") as f:
         text = f.read()
 
+    # tokens are generated while the parser reads them, never all at once
     lexer = Lexer(fn, text)
-    tokens, error = lexer.make_tokens()
-    if error:
-        return None, error
 
     try:
-        parser = Parser(tokens)
+        parser = Parser(lexer.generate_tokens())
         ast = parser.parse()
+        if lexer.error:
+            return None, lexer.error
         if ast.error:
             return None, ast.error
 
@@ -76,13 +86,15 @@ class Function(BaseFunction):
     Function Base Class
     """
 
-    __slots__ = ("body_node", "arg_names", "should_auto_return")
+    __slots__ = ("body_node", "arg_names", "should_auto_return", "source")
 
-    def __init__(self, name, body_node, arg_names, should_auto_return):
+    def __init__(self, name, body_node, arg_names, should_auto_return, source=None):
         super().__init__(name)
         self.body_node = body_node
         self.arg_names = arg_names
         self.should_auto_return = should_auto_return
+        # the text of the body, errors in it still need it after its AST is gone
+        self.source = source or source_buffer.source(body_node.pos_start)
 
     def execute(self, args):
         res = RTResult()
@@ -106,7 +118,11 @@ class Function(BaseFunction):
 
     def copy(self):
         copy = Function(
-            self.name, self.body_node, self.arg_names, self.should_auto_return
+            self.name,
+            self.body_node,
+            self.arg_names,
+            self.should_auto_return,
+            self.source,
         )
         copy.set_context(self.context)
         copy.set_pos(self.pos_start, self.pos_end)
@@ -1035,6 +1051,62 @@ class BuiltInFunction(BaseFunction):
 
     execute_split.arg_names = ["string", "sep"]
 
+    def execute_think_async(self, exec_ctx):
+        prompt = str(exec_ctx.symbol_table.get("prompt"))
+
+        if not brain.enabled and not precompiled.has(prompt):
+            return RTResult().failure(
+                RTError(
+                    self.pos_start,
+                    self.pos_end,
+                    "'think_async' is unavailable, the AI was disabled with --no-ai",
+                    exec_ctx,
+                )
+            )
+
+        # straight to the backends, the pipeline would only run one at a time
+        future = think_pool.submit(think_code, prompt)
+        return RTResult().success(ThinkHandle(prompt, future))
+
+    execute_think_async.arg_names = ["prompt"]
+
+    def execute_await_think(self, exec_ctx):
+        handle = exec_ctx.symbol_table.get("handle")
+
+        if not isinstance(handle, ThinkHandle):
+            return RTResult().failure(
+                RTError(
+                    self.pos_start,
+                    self.pos_end,
+                    "First argument for 'await_think' must be a handle from 'think_async'",
+                    exec_ctx,
+                )
+            )
+
+        start = time.perf_counter()
+        try:
+            gen_code = handle.future.result()
+        except BackendUnavailable as e:
+            return RTResult().failure(
+                RTError(self.pos_start, self.pos_end, str(e), exec_ctx)
+            )
+
+        # runs where await_think was called, like a think written there would
+        result = Interpreter().run_think_code(gen_code, exec_ctx.parent)
+        think_stats.record(handle.prompt, time.perf_counter() - start)
+        return result
+
+    execute_await_think.arg_names = ["handle"]
+
+    def execute_think_stats(self, exec_ctx):
+        summary = [
+            List([String(name), Number(value)])
+            for name, value in think_stats.summary().items()
+        ]
+        return RTResult().success(List(summary))
+
+    execute_think_stats.arg_names = []
+
 
 #######################################
 # SETUP VARIABLE FOR ALL BUILT IN FUNCTION
@@ -1090,6 +1162,30 @@ class Interpreter:
             List(elements).set_context(context).set_pos(node.pos_start, node.pos_end)
         )
 
+    def visit_statements(self, node, context: Context, plan=None, start=0):
+        """
+        Runs top level statements like visit_ListNode, handing upcoming think
+        prompts to the pipeline as soon as they can be evaluated. A plan over a
+        whole script is passed in with the index of these statements in it
+        """
+        if not think_pipeline.running or not isinstance(node, ListNode):
+            return self.visit(node, context)
+
+        res = RTResult()
+        elements = []
+        if plan is None:
+            plan = ThinkPlan(node.element_nodes)
+
+        for idx, element_node in enumerate(node.element_nodes):
+            think_pipeline.look_ahead(plan, start + idx, self, context)
+            elements.append(res.register(self.visit(element_node, context)))
+            if res.should_return():
+                return res
+
+        return res.success(
+            List(elements).set_context(context).set_pos(node.pos_start, node.pos_end)
+        )
+
     def visit_VarAccessNode(self, node, context: Context):
         res = RTResult()
         var_name = node.var_name_tok.value
@@ -1366,9 +1462,104 @@ class Interpreter:
         else:
             value = Null.null
 
-        gen_code = generate_code(value)
+        if not brain.enabled and not precompiled.has(str(value)):
+            return res.failure(
+                RTError(
+                    node.pos_start,
+                    node.pos_end,
+                    "'think' is unavailable, the AI was disabled with --no-ai",
+                    context,
+                )
+            )
+
+        start = time.perf_counter()
+        result = self.think(node, value, context)
+        think_stats.record(str(value), time.perf_counter() - start)
+        return result
+
+    def think(self, node, value, context):
+        res = RTResult()
+        # a think in a loop or function reuses the code it already got
+        gen_code = think_memo.lookup(node, str(value))
+        if gen_code is not None:
+            think_stats.note_source(str(value), "memo")
+        else:
+            fresh = think_memo.policy_of(node) == THINK_ALWAYS
+            if streaming.enabled:
+                return self.stream_think_code(node, value, fresh, context)
+            try:
+                gen_code = generate_code(value, fresh=fresh)
+            except BackendUnavailable as e:
+                return res.failure(
+                    RTError(node.pos_start, node.pos_end, str(e), context)
+                )
+            think_memo.store(node, str(value), gen_code)
+
+        return self.run_think_code(gen_code, context)
+
+    def run_think_code(self, gen_code, context):
+        """
+        Runs generated code as if it was written where the think is, the value of
+        its last statement is what the think evaluates to
+        """
+        res = RTResult()
+        # nothing was generated, so there is nothing to run
+        if not gen_code.strip():
+            return res.success(Null.null)
+
+        statements, error = think_asts.compile(gen_code)
+        if error:
+            return res.failure(error)
+        return self.run_think_statements(statements, context)
+
+    def run_think_statements(self, statements, context):
+        res = RTResult()
+        result = res.register(self.visit_statements(statements, context))
+        if res.should_return():
+            return res
+
+        if not result.elements:
+            return res.success(Null.null)
+        return res.success(result.elements[-1])
 
-        return res.success(gen_code)
+    def stream_think_code(self, node, value, fresh, context):
+        """
+        Runs generated code while the backend is still writing it, every top level
+        statement as soon as it is complete. Statements that already ran stay
+        done when a later one fails to parse
+        """
+        res = RTResult()
+        stream = StatementStream()
+        result = Null.null
+        chunks = think_code_stream(value, fresh)
+        try:
+            with StreamProgress(value) as progress:
+                for chunk in chunks:
+                    statements = stream.feed(chunk)
+                    if statements is not None:
+                        progress.pause()
+                        result = res.register(
+                            self.run_think_statements(statements, context)
+                        )
+                        if res.should_return():
+                            return res
+                        progress.resume()
+                    progress.update(stream)
+        except BackendUnavailable as e:
+            return res.failure(RTError(node.pos_start, node.pos_end, str(e), context))
+        finally:
+            # stops the model when the code failed before it was fully written
+            chunks.close()
+
+        think_memo.store(node, str(value), stream.code)
+        statements, error = stream.finish()
+        if error:
+            return res.failure(error)
+        if statements is not None:
+            result = res.register(self.run_think_statements(statements, context))
+            if res.should_return():
+                return res
+        return res.success(result)
 
     def visit_ContinueNode(self, node, context):
         return RTResult().success_continue()
@@ -1438,30 +1629,26 @@ private_symbol_table.set("is_main", Number(0))
 #######################################
 
 
-def run(fn, text):
-    # Generate tokens
+def parse_text(fn, text):
+    """The AST of a text and None, or None and its lex or parse error"""
+    # tokens are generated while the parser reads them, never all at once
     lexer = Lexer(fn, text)
-    tokens, error = lexer.make_tokens()
-    if error:
-        return None, error
+    ast = Parser(lexer.generate_tokens()).parse()
+    if lexer.error:
+        return None, lexer.error
+    if ast.error:
+        return None, ast.error
+    return ast.node, None
 
-    result = None
-    # Generate AST
-    context = None
 
+def execute(fn, node, plan=None, start=0):
     try:
-        parser = Parser(tokens)
-        ast = parser.parse()
-        if ast.error:
-            return None, ast.error
-
-        # Run program
         interpreter = Interpreter()
         context = Context(f"<{fn}>")
         context.symbol_table = global_symbol_table
         context.private_symbol_table = private_symbol_table
         context.private_symbol_table.set("is_main", Number(1))
-        result = interpreter.visit(ast.node, context)
+        result = interpreter.visit_statements(node, context, plan, start)
         result.value = "" if str(result.value) == "null" else result.value
         return result.value, result.error
     except KeyboardInterrupt:
@@ -1469,3 +1656,44 @@ def run(fn, text):
             position_start, position_end, "Execution interrupted"
         )
         return None, err
+
+
+def run(fn, text):
+    try:
+        node, error = parse_text(fn, text)
+    except KeyboardInterrupt:
+        err = KeyboardInterruptError(
+            position_start, position_end, "Execution interrupted"
+        )
+        return None, err
+    if error:
+        return None, error
+    return execute(fn, node)
+
+
+def run_script(fn, lines):
+    """
+    Runs the lines of a script one after another like run(), yielding each
+    one's result and error. Every line is parsed first, so the think pipeline
+    looks ahead across the whole script instead of within a single line
+    """
+    parsed = [parse_text(fn, line) for line in lines]
+    plan = None
+    if think_pipeline.running:
+        plan = ThinkPlan(
+            [
+                statement
+                for node, _ in parsed
+                if isinstance(node, ListNode)
+                for statement in node.element_nodes
+            ]
+        )
+
+    start = 0
+    for node, error in parsed:
+        if error:
+            yield None, error
+            continue
+        yield execute(fn, node, plan, start)
+        if isinstance(node, ListNode):
+            start += len(node.element_nodes)
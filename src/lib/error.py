@@ -1,3 +1,5 @@
+from .utils import source_buffer
+
 #######################################
 # HELPER FUNCTIONS
 #######################################
@@ -38,7 +40,7 @@ position_start = None
 position_end = None
 
 class Error:
-    __slots__ = ['pos_start', 'pos_end', 'error_name', 'details']
+    __slots__ = ['pos_start', 'pos_end', 'error_name', 'details', 'sources']
 
     def __init__(self, pos_start, pos_end, error_name, details):
         global position_start, position_end
@@ -49,14 +51,21 @@ class Error:
         self.pos_end = pos_end
         self.error_name = error_name
         self.details = details
+        # keeps the texts the error points into alive for as long as it is around
+        self.sources = [source_buffer.source(pos_start), source_buffer.source(pos_end)]
         
 
+    def positions(self):
+        """Line and column of both ends, only worked out now the error is shown"""
+        return (source_buffer.position(self.pos_start),
+                source_buffer.position(self.pos_end, end=True))
+
     def __str__(self):
+        pos_start, pos_end = self.positions()
         result = f'{self.error_name}: {self.details}\n'
-        result += f'File {self.pos_start.fn}, line {self.pos_start.ln + 1}'
+        result += f'File {pos_start.fn}, line {pos_start.ln + 1}'
         result += '\n\n' + \
-            string_with_arrows(self.pos_start.ftxt,
-                               self.pos_start, self.pos_end)
+            string_with_arrows(pos_start.ftxt, pos_start, pos_end)
         return result
 
 
@@ -84,22 +93,28 @@ class RTError(Error):
         super().__init__(pos_start, pos_end, 'Runtime Error', details)
         self.context = context
 
+        ctx = context
+        while ctx:
+            self.sources.append(source_buffer.source(ctx.parent_entry_pos))
+            ctx = ctx.parent
+
     def __str__(self):
+        pos_start, pos_end = self.positions()
         result = self.generate_traceback()
         result += f'{self.error_name}: {self.details}'
         result += '\n\n' + \
-            string_with_arrows(self.pos_start.ftxt,
-                               self.pos_start, self.pos_end)
+            string_with_arrows(pos_start.ftxt, pos_start, pos_end)
         return result
 
     def generate_traceback(self):
         result = ''
-        pos = self.pos_start
+        offset = self.pos_start
         ctx = self.context
 
         while ctx:
+            pos = source_buffer.position(offset)
             result = f'  File {pos.fn}, line {str(pos.ln + 1)}, in {ctx.display_name}\n' + result
-            pos = ctx.parent_entry_pos
+            offset = ctx.parent_entry_pos
             ctx = ctx.parent
 
         return 'Traceback (most recent call last):\n' + result
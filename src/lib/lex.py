@@ -2,293 +2,220 @@
 # LEXER
 #######################################
 
-from .utils import Token, Position, RTResult
+import re
+
+from .utils import Token, RTResult, source_buffer
 from ..consts import *
 from .error import IllegalCharError, ExpectedCharError
 
+# every token in one pass of a single compiled pattern, with the blanks before
+# it. A character it cannot match is left as a gap, and reported like before
+TOKEN_REGEX = re.compile(
+    r"""
+    [ \t]*
+    (?:
+    (?P<identifier>[A-Za-z_][A-Za-z0-9_]*)
+    |(?P<operator>->|==|!=|<=|>=|[-+*/^%()\[\]=<>,.])
+    |(?P<newline>[;\n])
+    |(?P<number>[0-9]+(?:\.[0-9]*)?)
+    |(?P<string>"(?P<string_body>(?:[^"\\]|\\[\s\S])*)\\?(?P<string_end>")?)
+    |(?P<single>'(?P<single_body>[^']*)(?P<single_end>')?)
+    |(?P<comment>\#[^\n]*)
+    |(?P<eof>\Z)
+    )
+    """,
+    re.VERBOSE,
+)
+BLANKS = re.compile("[ \t]*")
+# what makes the lexer put a `var` before a name written without one: a `+=`
+# one character after it, or an `=` after spaces that is not `==` (as long as
+# the second character after the name is not an `=`, which is what it checks)
+DECLARATION = re.compile(r"[\s\S]\+=|(?![\s\S][\s\S]=) *=")
+ESCAPE_REGEX = re.compile(r"\\([\s\S])")
+ESCAPE_CHARACTERS = {"n": "\n", "t": "\t"}
+
+OPERATORS = {
+    "+": TT_PLUS,
+    "-": TT_MINUS,
+    "*": TT_MUL,
+    "/": TT_DIV,
+    "^": TT_POW,
+    "%": TT_MOD,
+    "(": TT_LPAREN,
+    ")": TT_RPAREN,
+    "[": TT_LSQUARE,
+    "]": TT_RSQUARE,
+    "=": TT_EQ,
+    "<": TT_LT,
+    ">": TT_GT,
+    ",": TT_COMMA,
+    ".": TT_DOT,
+    "->": TT_ARROW,
+    "==": TT_EE,
+    "!=": TT_NE,
+    "<=": TT_LTE,
+    ">=": TT_GTE,
+}
+KEYWORD_SET = frozenset(KEYWORDS)
+
+
+def unescape(match):
+    char = match.group(1)
+    return ESCAPE_CHARACTERS.get(char, char)
+
+
+class TokenList(list):
+    """The tokens of a whole text, which keep the text alive while they are around"""
+
+    __slots__ = ("source",)
+
 
 class Lexer:
-    __slots__ = ["fn", "text", "pos", "current_char", "tokens"]
+    __slots__ = ["fn", "text", "tokens", "source", "error"]
 
     def __init__(self, fn, text):
         self.fn = fn
         self.text = text
-        self.pos = Position(-1, 0, -1, fn, text)
-        self.current_char = None
-        self.advance()
         self.tokens = []
-
-    def advance(self):
-        self.pos.advance(self.current_char)
-        self.current_char = (
-            self.text[self.pos.idx] if self.pos.idx < len(self.text) else None
-        )
+        self.source = None
+        self.error = None
 
     def make_tokens(self):
-        while self.current_char != None:
-            if self.current_char in " \t":
-                self.advance()
-            elif self.current_char == "#":
-                self.skip_comment()
-            elif self.current_char in ";\n":
-                self.tokens.append(Token(TT_NEWLINE, pos_start=self.pos))
-                self.advance()
-            elif self.current_char in DIGITS:
-                self.tokens.append(self.make_number())
-            elif self.current_char in LETTERS + "_":
-                self.tokens.append(self.make_identifier())
-            elif self.current_char == '"':
-                self.tokens.append(self.make_string())
-            elif self.current_char == "'":
-                self.tokens.append(self.make_string_single())
-            elif self.current_char == "+":
-                self.tokens.append(Token(TT_PLUS, pos_start=self.pos))
-                self.advance()
-            elif self.current_char == "-":
-                self.tokens.append(self.make_minus_or_arrow())
-            elif self.current_char == "*":
-                self.tokens.append(Token(TT_MUL, pos_start=self.pos))
-                self.advance()
-            elif self.current_char == "/":
-                self.tokens.append(Token(TT_DIV, pos_start=self.pos))
-                self.advance()
-            elif self.current_char == "^":
-                self.tokens.append(Token(TT_POW, pos_start=self.pos))
-                self.advance()
-            elif self.current_char == "%":
-                self.tokens.append(Token(TT_MOD, pos_start=self.pos))
-                self.advance()
-            elif self.current_char == "(":
-                self.tokens.append(Token(TT_LPAREN, pos_start=self.pos))
-                self.advance()
-            elif self.current_char == ")":
-                self.tokens.append(Token(TT_RPAREN, pos_start=self.pos))
-                self.advance()
-            elif self.current_char == "[":
-                self.tokens.append(Token(TT_LSQUARE, pos_start=self.pos))
-                self.advance()
-            elif self.current_char == "]":
-                self.tokens.append(Token(TT_RSQUARE, pos_start=self.pos))
-                self.advance()
-            elif self.current_char == "!":
-                token, error = self.make_not_equals()
-                if error:
-                    return [], error
-                self.tokens.append(token)
-            elif self.current_char == "=":
-                self.tokens.append(self.make_equals())
-            elif self.current_char == "<":
-                self.tokens.append(self.make_less_than())
-            elif self.current_char == ">":
-                self.tokens.append(self.make_greater_than())
-            elif self.current_char == ",":
-                self.tokens.append(Token(TT_COMMA, pos_start=self.pos))
-                self.advance()
-            elif self.current_char == ".":
-                self.tokens.append(Token(TT_DOT, value=".", pos_start=self.pos))
-                self.advance()
-            else:
-                pos_start = self.pos.copy()
-                char = self.current_char
-                self.advance()
-                return [], IllegalCharError(pos_start, self.pos, "'" + char + "'")
-
-        self.tokens.append(Token(TT_EOF, pos_start=self.pos))
-        return self.tokens, None
-
-    def make_number(self):
-        num_str = ""
-        dot_count = 0
-        pos_start = self.pos.copy()
-
-        while self.current_char != None and self.current_char in DIGITS + ".":
-            if self.current_char == ".":
-                if dot_count == 1:
-                    break
-                dot_count += 1
-            num_str += self.current_char
-            self.advance()
-
-        if dot_count == 0:
-            return Token(TT_INT, int(num_str), pos_start, self.pos)
-        else:
-            return Token(TT_FLOAT, float(num_str), pos_start, self.pos)
-
-    def make_string_single(self):
-        string = ""
-        pos_start = self.pos.copy()
-        escape_character = False
-        self.advance()
-
-        escape_characters = {"n": "\n", "t": "\t"}
-
-        while self.current_char != None and (
-            self.current_char != "'" or escape_character
-        ):
-            if escape_character:
-                string += escape_characters.get(self.current_char, self.current_char)
-            else:
-                if self.current_char == "\\":
-                    escape_character = True
+        tokens = TokenList(self.generate_tokens())
+        if self.error:
+            return [], self.error
+        tokens.source = self.source
+        self.tokens = tokens
+        return tokens, None
+
+    def generate_tokens(self):
+        """
+        The tokens one at a time while the text is scanned, so a parser reading
+        them never needs all of them at once. A lex error is kept in self.error
+        and ends the tokens with an EOF where it is
+        """
+        text = self.text
+        # positions are offsets into the source buffer, lines and columns are
+        # only worked out from them when an error is shown
+        self.source = source_buffer.add(self.fn, text)
+        base = self.source.base
+        end = 0
+        after_var = False
+
+        for match in TOKEN_REGEX.finditer(text):
+            if match.start() != end:
+                break
+            kind = match.lastgroup
+            start, end = match.span(kind)
+
+            if kind == "identifier":
+                value = match.group(kind)
+                if not after_var and DECLARATION.match(text, end):
+                    yield Token(TT_KEYWORD, "var", base + start, base + end)
+                if value in KEYWORD_SET:
+                    yield Token(TT_KEYWORD, value, base + start, base + end)
                 else:
-                    string += self.current_char
-            self.advance()
-            escape_character = False
-
-        self.advance()
-        return Token(TT_STRING, string, pos_start, self.pos)
-
-    def make_string(self):
-        string = ""
-        pos_start = self.pos.copy()
-        escape_character = False
-        self.advance()
-
-        escape_characters = {"n": "\n", "t": "\t"}
-
-        while self.current_char != None and (
-            self.current_char != '"' or escape_character
-        ):
-            if escape_character:
-                string += escape_characters.get(
-                    self.current_char,
-                    "\\" if self.current_char == "\\" else self.current_char,
+                    yield Token(TT_IDENTIFIER, value, base + start, base + end)
+                after_var = value == "var"
+                continue
+            elif kind == "operator":
+                value = match.group(kind)
+                yield Token(
+                    OPERATORS[value],
+                    "." if value == "." else None,
+                    base + start,
+                    base + end,
                 )
-                escape_character = False
-            else:
-                if self.current_char == "\\":
-                    escape_character = True
+            elif kind == "newline":
+                yield Token(TT_NEWLINE, None, base + start, base + end)
+            elif kind == "number":
+                value = match.group(kind)
+                if "." in value:
+                    yield Token(TT_FLOAT, float(value), base + start, base + end)
                 else:
-                    string += self.current_char
-
-            self.advance()
-
-        self.advance()
-        return Token(TT_STRING, string, pos_start, self.pos)
-
-    def peek_foward(self) -> str | None:
-        peek_pos = self.pos.copy()
-        while self.text[peek_pos.idx : peek_pos.idx + 1] == " ":
-            peek_pos.idx += 1
-        if peek_pos.idx > len(self.text):
-            return None
-        forward = self.text[peek_pos.idx : peek_pos.idx + 1]
-        return forward
-
-    def peek_foward_steps(self, steps) -> str | None:
-        peek_pos = self.pos.copy()
-        for _ in range(steps):
-            if peek_pos.idx > len(self.text):
-                return None
-            peek_pos.idx += 1
-        return self.text[peek_pos.idx : peek_pos.idx + 1]
-
-    def peek_backward_steps(self, steps) -> str | None:
-        peek_pos = self.pos.copy()
-        for _ in range(steps):
-            if peek_pos.idx < 0:
-                return None
-            peek_pos.idx -= 1
-        return self.text[peek_pos.idx : peek_pos.idx + 1]
-
-    def previous_token(self) -> Token:
-        try:
-            return self.tokens[-1]
-        except IndexError:
-            return None
-
-    def make_identifier(self) -> Token:
-        id_str = ""
-        pos_start = self.pos.copy()
-
-        while self.current_char != None and self.current_char in LETTERS_DIGITS + "_":
-            id_str += self.current_char
-            self.advance()
-
-        pt: Token = self.previous_token()
-        pfs = self.peek_foward_steps(2)
-        rv = (str(self.peek_foward_steps(1)) + str(pfs)) == "+="
-        if self.peek_foward() == "=" or rv:
-            if rv and (pt is None or pt.value != "var"):
-                self.tokens.append(
-                    Token(
-                        TT_KEYWORD, value="var", pos_start=pos_start, pos_end=self.pos
-                    )
+                    yield Token(TT_INT, int(value), base + start, base + end)
+            elif kind == "string":
+                value = match.group("string_body")
+                if "\\" in value:
+                    value = ESCAPE_REGEX.sub(unescape, value)
+                # an unclosed string runs one past the end of the text
+                if match.group("string_end") is None:
+                    end += 1
+                yield Token(TT_STRING, value, base + start, base + end)
+                # a "var" string stops the next name from declaring, like the keyword
+                after_var = value == "var"
+                continue
+            elif kind == "single":
+                # single quotes drop every backslash and end at the next quote
+                value = match.group("single_body").replace("\\", "")
+                if match.group("single_end") is None:
+                    end += 1
+                yield Token(TT_STRING, value, base + start, base + end)
+                after_var = value == "var"
+                continue
+            after_var = False
+
+        if end < len(text):
+            # the gap starts with the blanks the pattern would have skipped
+            end = BLANKS.match(text, end).end()
+            char = text[end]
+            if char == "!":
+                # the character after the '!' is underlined too, unless it ends the line
+                skipped = 1 if text.startswith("\n", end + 1) else 2
+                self.error = ExpectedCharError(
+                    base + end, base + end + skipped, "'=' (after '!')"
                 )
-            elif (pfs is not None and pfs != "=") and (pt is None or pt.value != "var"):
-                self.tokens.append(
-                    Token(
-                        TT_KEYWORD, value="var", pos_start=pos_start, pos_end=self.pos
-                    )
+            else:
+                self.error = IllegalCharError(
+                    base + end, base + end + 1, "'" + char + "'"
                 )
 
-        tok_type = TT_KEYWORD if id_str in KEYWORDS else TT_IDENTIFIER
-        return Token(tok_type, id_str, pos_start, self.pos)
-
-    def make_minus_or_arrow(self) -> Token:
-        tok_type = TT_MINUS
-        pos_start = self.pos.copy()
-        self.advance()
-
-        if self.current_char == ">":
-            self.advance()
-            tok_type = TT_ARROW
-
-        return Token(tok_type, pos_start=pos_start, pos_end=self.pos)
-
-    def make_not_equals(self):
-        pos_start = self.pos.copy()
-        self.advance()
-
-        if self.current_char == "=":
-            self.advance()
-            return Token(TT_NE, pos_start=pos_start, pos_end=self.pos), None
-
-        self.advance()
-        return None, ExpectedCharError(pos_start, self.pos, "'=' (after '!')")
-
-    def make_equals(self) -> Token:
-        tok_type = TT_EQ
-        pos_start = self.pos.copy()
-        self.advance()
+        yield Token(TT_EOF, None, base + end, base + end + 1)
 
-        if self.current_char == "=":
-            self.advance()
-            tok_type = TT_EE
 
-        return Token(tok_type, pos_start=pos_start, pos_end=self.pos)
-
-    def make_less_than(self) -> Token:
-        tok_type = TT_LT
-        pos_start = self.pos.copy()
-        self.advance()
-
-        if self.current_char == "=":
-            self.advance()
-            tok_type = TT_LTE
-
-        return Token(tok_type, pos_start=pos_start, pos_end=self.pos)
-
-    def make_greater_than(self) -> Token:
-        tok_type = TT_GT
-        pos_start = self.pos.copy()
-        self.advance()
-
-        if self.current_char == "=":
-            self.advance()
-            tok_type = TT_GTE
-
-        return Token(tok_type, pos_start=pos_start, pos_end=self.pos)
-
-    def skip_comment(self) -> None:
-        self.advance()
-
-        while self.current_char != None and self.current_char != "\n":
-            self.advance()
-
-    def make_plus_or_pequal(self) -> Token:
-        tok_type = TT_PLUS
-        pos_start = self.pos.copy()
-        self.advance()
+#######################################
+# INCREMENTAL LEX STATE
+#######################################
 
-        return Token(tok_type, pos_start=pos_start, pos_end=self.pos)
+# mirrors the character dispatch of Lexer.make_tokens, so partially written code
+# can be checked one character at a time instead of re-lexing all of it
+
+LS_ILLEGAL = -1
+LS_CODE = 0
+LS_BANG = 1
+LS_STRING = 2
+LS_STRING_ESCAPE = 3
+LS_STRING_SINGLE = 4
+LS_COMMENT = 5
+
+CODE_CHARS = frozenset(" \t;\n" + LETTERS_DIGITS + "_+-*/^%()[]=<>,.")
+
+
+def lex_step(state, char):
+    """The lexer state after reading char, or LS_ILLEGAL if it would raise"""
+    if state == LS_CODE:
+        if char in CODE_CHARS:
+            return LS_CODE
+        elif char == '"':
+            return LS_STRING
+        elif char == "'":
+            return LS_STRING_SINGLE
+        elif char == "#":
+            return LS_COMMENT
+        elif char == "!":
+            return LS_BANG
+        return LS_ILLEGAL
+    elif state == LS_BANG:
+        return LS_CODE if char == "=" else LS_ILLEGAL
+    elif state == LS_STRING:
+        if char == "\\":
+            return LS_STRING_ESCAPE
+        return LS_CODE if char == '"' else LS_STRING
+    elif state == LS_STRING_ESCAPE:
+        return LS_STRING
+    elif state == LS_STRING_SINGLE:
+        # make_string_single drops its escape flag right away, so a quote always ends it
+        return LS_CODE if char == "'" else LS_STRING_SINGLE
+    elif state == LS_COMMENT:
+        return LS_CODE if char == "\n" else LS_COMMENT
+    return LS_ILLEGAL
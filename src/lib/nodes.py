@@ -30,13 +30,15 @@ class StringNode:
 
 
 class ListNode:
-    __slots__ = ["element_nodes", "pos_start", "pos_end"]
+    __slots__ = ["element_nodes", "pos_start", "pos_end", "source"]
 
     def __init__(self, element_nodes, pos_start, pos_end):
         self.element_nodes = element_nodes
 
         self.pos_start = pos_start
         self.pos_end = pos_end
+        # set on the root of a parsed text, which keeps the text alive
+        self.source = None
 
 
 class VarAccessNode:
@@ -235,10 +237,36 @@ class ImportNode:
 
 
 class ThinkNode:
-    __slots__ = ["node_to_think", "pos_start", "pos_end"]
+    __slots__ = ["node_to_think", "policy", "memo", "pos_start", "pos_end"]
 
-    def __init__(self, node_to_think, pos_start, pos_end):
+    def __init__(self, node_to_think, pos_start, pos_end, policy=None):
         self.node_to_think = node_to_think
+        # memoization policy of this call site, None for the default one
+        self.policy = policy
+        self.memo = {}
 
         self.pos_start = pos_start
         self.pos_end = pos_end
+
+
+#######################################
+# HELPERS
+#######################################
+
+
+def walk(node):
+    """Yields the node and every node nested below it, depth first"""
+    if isinstance(node, (list, tuple)):
+        for item in node:
+            yield from walk(item)
+        return
+
+    if not type(node).__name__.endswith("Node"):
+        return
+
+    yield node
+    fields = getattr(node, "__slots__", None) or vars(node)
+    for field in fields:
+        if field in ("pos_start", "pos_end"):
+            continue
+        yield from walk(getattr(node, field, None))
@@ -15,7 +15,7 @@ from .nodes import *
 from .parsing_types import *
 from .lex import Lexer, RTResult
 from .parsing_types import *
-from .utils import Token
+from .utils import Token, source_buffer
 import os
 from pathlib import Path
 
@@ -59,6 +59,62 @@ class ParseResult:
         return self
 
 
+#######################################
+# TOKEN BUFFER
+#######################################
+
+
+class TokenBuffer:
+    """
+    The tokens a parser can still look at. A list is used as it is, tokens from
+    a generator are only pulled in once the parser gets to them and dropped again
+    once it is past them, so a long text never has all its tokens at once
+    """
+
+    __slots__ = ("tokens", "start", "source", "streaming")
+
+    def __init__(self, tokens):
+        # a list was handed in whole and may still be used by whoever made it
+        self.streaming = not isinstance(tokens, list)
+        if self.streaming:
+            self.tokens = []
+            self.source = iter(tokens)
+        else:
+            self.tokens = tokens
+            self.source = None
+        # index of self.tokens[0] in the whole text
+        self.start = 0
+
+    def get(self, idx):
+        """The token at an index in the whole text, None past the last one"""
+        idx -= self.start
+        tokens = self.tokens
+        if 0 <= idx < len(tokens):
+            return tokens[idx]
+        while idx >= len(tokens) and self.source is not None:
+            token = next(self.source, None)
+            if token is None:
+                self.source = None
+                break
+            tokens.append(token)
+        if 0 <= idx < len(tokens):
+            return tokens[idx]
+        return None
+
+    def release(self, idx):
+        """Drops the tokens before an index, the parser never goes back to them"""
+        if self.streaming and idx > self.start:
+            del self.tokens[: idx - self.start]
+            self.start = idx
+
+    def drain(self):
+        """Reads the rest of the tokens without keeping them, for an error further along"""
+        if self.source is not None:
+            for _ in self.source:
+                pass
+            self.source = None
+
+
 #######################################
 # PARSER
 #######################################
@@ -68,7 +124,7 @@ class Parser:
     __slots__ = ("tokens", "tok_idx", "current_tok")
 
     def __init__(self, tokens):
-        self.tokens = tokens
+        self.tokens = TokenBuffer(tokens)
         self.tok_idx = -1
         self.advance()
 
@@ -83,27 +139,34 @@ class Parser:
         return self.current_tok
 
     def update_current_tok(self):
-        if self.tok_idx >= 0 and self.tok_idx < len(self.tokens):
-            self.current_tok: Token = self.tokens[self.tok_idx]
+        token = self.tokens.get(self.tok_idx)
+        if token is not None:
+            self.current_tok: Token = token
 
     def parse(self):
-        res = self.statements()
+        res = self.statements(top_level=True)
         if not res.error and self.current_tok.type != TT_EOF:
-            return res.failure(
+            res.failure(
                 InvalidSyntaxError(
                     self.current_tok.pos_start,
                     self.current_tok.pos_end,
                     "Token cannot appear after previous tokens",
                 )
             )
+        if res.node is not None:
+            res.node.source = source_buffer.source(res.node.pos_start)
+        if res.error:
+            # a lexer generating the tokens may still run into an error further
+            # along, which is reported instead like when it lexed everything first
+            self.tokens.drain()
         return res
 
     ###################################
 
-    def statements(self):
+    def statements(self, top_level=False):
         res = ParseResult()
         statements = []
-        pos_start = self.current_tok.pos_start.copy()
+        pos_start = self.current_tok.pos_start
 
         while self.current_tok.type == TT_NEWLINE:
             res.register_advancement()
@@ -127,6 +190,10 @@ class Parser:
 
             if not more_statements:
                 break
+            # a failed statement is only reversed to its own start, so at the top
+            # level nothing before it is needed again but the token peeked back at
+            if top_level:
+                self.tokens.release(self.tok_idx - 1)
             statement = res.try_register(self.statement())
             if not statement:
                 self.reverse(res.to_reverse_count)
@@ -134,13 +201,11 @@ class Parser:
                 continue
             statements.append(statement)
 
-        return res.success(
-            ListNode(statements, pos_start, self.current_tok.pos_end.copy())
-        )
+        return res.success(ListNode(statements, pos_start, self.current_tok.pos_end))
 
     def statement(self):
         res = ParseResult()
-        pos_start = self.current_tok.pos_start.copy()
+        pos_start = self.current_tok.pos_start
 
         if self.current_tok.matches(TT_KEYWORD, "return"):
             res.register_advancement()
@@ -149,32 +214,40 @@ class Parser:
             expr = res.try_register(self.expr())
             if not expr:
                 self.reverse(res.to_reverse_count)
-            return res.success(
-                ReturnNode(expr, pos_start, self.current_tok.pos_start.copy())
-            )
+            return res.success(ReturnNode(expr, pos_start, self.current_tok.pos_start))
 
         if self.current_tok.matches(TT_KEYWORD, "think"):
             res.register_advancement()
             self.advance()
 
+            policy = None
+            next_tok = self.peek_tok()
+            if (
+                self.current_tok.type == TT_IDENTIFIER
+                and self.current_tok.value in THINK_POLICIES
+                and next_tok is not None
+                and next_tok.type in (TT_STRING, TT_IDENTIFIER, TT_INT, TT_FLOAT)
+            ):
+                policy = self.current_tok.value
+                res.register_advancement()
+                self.advance()
+
             expr = res.try_register(self.expr())
             if not expr:
                 self.reverse(res.to_reverse_count)
             return res.success(
-                ThinkNode(expr, pos_start, self.current_tok.pos_start.copy())
+                ThinkNode(expr, pos_start, self.current_tok.pos_start, policy)
             )
 
         if self.current_tok.matches(TT_KEYWORD, "continue"):
             res.register_advancement()
             self.advance()
-            return res.success(
-                ContinueNode(pos_start, self.current_tok.pos_start.copy())
-            )
+            return res.success(ContinueNode(pos_start, self.current_tok.pos_start))
 
         if self.current_tok.matches(TT_KEYWORD, "break"):
             res.register_advancement()
             self.advance()
-            return res.success(BreakNode(pos_start, self.current_tok.pos_start.copy()))
+            return res.success(BreakNode(pos_start, self.current_tok.pos_start))
 
         expr = res.register(self.expr())
         if res.error:
@@ -188,14 +261,12 @@ class Parser:
         return res.success(expr)
 
     def peek_tok(self) -> Token:
-        if self.tok_idx + 1 >= len(self.tokens):
-            return None
-        return self.tokens[self.tok_idx + 1]
+        return self.tokens.get(self.tok_idx + 1)
 
     def peek_tok_back(self) -> Token:
         if self.tok_idx - 1 < 0:
             return None
-        return self.tokens[self.tok_idx - 1]
+        return self.tokens.get(self.tok_idx - 1)
 
     def expr(self):
         res = ParseResult()
@@ -448,7 +519,7 @@ class Parser:
     def list_expr(self):
         res = ParseResult()
         element_nodes = []
-        pos_start = self.current_tok.pos_start.copy()
+        pos_start = self.current_tok.pos_start
 
         if self.current_tok.type != TT_LSQUARE:
             return res.failure(
@@ -496,9 +567,7 @@ class Parser:
             res.register_advancement()
             self.advance()
 
-        return res.success(
-            ListNode(element_nodes, pos_start, self.current_tok.pos_end.copy())
-        )
+        return res.success(ListNode(element_nodes, pos_start, self.current_tok.pos_end))
 
     def if_expr(self):
         res = ParseResult()
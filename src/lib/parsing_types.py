@@ -632,3 +632,30 @@ class File(Object):
 
     def __repr__(self):
         return f"<File {self.name}>"
+
+
+class ThinkHandle(Object):
+    """A think started with think_async, await_think gets its value"""
+
+    __slots__ = ("prompt", "future")
+
+    def __init__(self, prompt, future):
+        super().__init__()
+        self.prompt = prompt
+        self.future = future
+
+    def copy(self):
+        copy = ThinkHandle(self.prompt, self.future)
+        copy.set_pos(self.pos_start, self.pos_end)
+        copy.set_context(self.context)
+        return copy
+
+    def is_true(self):
+        return True
+
+    def type(self):
+        return "<ThinkHandle>"
+
+    def __repr__(self):
+        state = "done" if self.future.done() else "pending"
+        return f'<ThinkHandle "{self.prompt}" {state}>'
@@ -1,3 +1,6 @@
+from bisect import bisect_right
+import threading
+import weakref
 
 
 class Token:
@@ -7,13 +10,13 @@ class Token:
         self.type = type_
         self.value = value
 
-        if pos_start:
-            self.pos_start = pos_start.copy()
-            self.pos_end = pos_start.copy()
-            self.pos_end.advance()
+        # offsets into the source buffer, ints are never changed so nothing is copied
+        if pos_start is not None:
+            self.pos_start = pos_start
+            self.pos_end = pos_start + 1
 
-        if pos_end:
-            self.pos_end = pos_end.copy()
+        if pos_end is not None:
+            self.pos_end = pos_end
     
 
     def matches(self, type_, value):
@@ -41,18 +44,108 @@ class Position:
         self.fn = fn
         self.ftxt = ftxt
 
-    def advance(self, current_char=None):
-        self.idx += 1
-        self.col += 1
 
-        if current_char == '\n':
-            self.ln += 1
-            self.col = 0
+class Source:
+    """A lexed text, and where each of its lines starts once an error needs it"""
 
-        return self
+    __slots__ = ['fn', 'text', 'base', 'line_starts', '__weakref__']
+
+    def __init__(self, fn, text, base):
+        self.fn = fn
+        self.text = text
+        self.base = base
+        self.line_starts = None
+
+    def position(self, offset, end=False):
+        """
+        The line and column of an offset. An end offset belongs to the character
+        before it, so a token ending in a newline does not end on the next line
+        """
+        if self.line_starts is None:
+            starts = [0]
+            idx = self.text.find('\n')
+            while idx != -1:
+                starts.append(idx + 1)
+                idx = self.text.find('\n', idx + 1)
+            self.line_starts = starts
+
+        idx = offset - self.base
+        back = 1 if end and idx > 0 else 0
+        ln = bisect_right(self.line_starts, idx - back) - 1
+        col = idx - back - self.line_starts[ln] + back
+        return Position(idx, ln, col, self.fn, self.text)
+
+
+class SourceBuffer:
+    """
+    Every lexed text laid end to end, so a position is one int offset into all
+    of them. Which text an offset belongs to, and its line and column, are only
+    worked out when an error is shown. Texts are only held weakly, each one
+    lives as long as its lexer, its AST, the functions defined in it and the
+    errors pointing into it
+    """
+
+    __slots__ = ['bases', 'sources', 'size', 'dead', 'lock']
 
-    def copy(self):
-        return Position(self.idx, self.ln, self.col, self.fn, self.ftxt)
+    def __init__(self):
+        self.bases = []
+        self.sources = []
+        self.size = 0
+        # texts freed since the last prune
+        self.dead = 0
+        self.lock = threading.Lock()
+
+    def add(self, fn, text):
+        with self.lock:
+            if self.dead > len(self.sources) // 2:
+                self.prune()
+            source = Source(fn, text, self.size)
+            # tokens may end up to three characters past the text, like the EOF
+            # after an unclosed string
+            self.size += len(text) + 3
+            self.bases.append(source.base)
+            self.sources.append(weakref.ref(source, self.forget))
+        return source
+
+    def forget(self, ref):
+        # runs whenever a text is freed, the entries are only pruned once
+        # enough of them are dead
+        self.dead += 1
+
+    def prune(self):
+        live = [(base, ref) for base, ref in zip(self.bases, self.sources) if ref()]
+        self.bases = [base for base, _ in live]
+        self.sources = [ref for _, ref in live]
+        self.dead = 0
+
+    def discard(self, source):
+        """Forgets a text whose tokens were thrown away, no error can point into it"""
+        with self.lock:
+            idx = bisect_right(self.bases, source.base) - 1
+            if idx >= 0 and self.sources[idx]() is source:
+                del self.bases[idx]
+                del self.sources[idx]
+
+    def source(self, offset):
+        """The text an offset points into, None if it was freed"""
+        if offset is None:
+            return None
+        with self.lock:
+            idx = bisect_right(self.bases, offset) - 1
+            source = self.sources[idx]() if idx >= 0 else None
+        if source is None or offset > source.base + len(source.text) + 2:
+            return None
+        return source
+
+    def position(self, offset, end=False):
+        source = self.source(offset)
+        if source is None:
+            # only values that outlived every reference to their text get here
+            return Position(0, 0, 0, '<unknown>', '')
+        return source.position(offset, end)
+
+
+source_buffer = SourceBuffer()
 
 
 
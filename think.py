@@ -1,35 +1,253 @@
-from src.interpreter import run, VERSION, ASCII_NAME
+from src.interpreter import run, run_script, VERSION, ASCII_NAME
+from src.ai.model import brain, preload
+from src.ai.prefix_cache import prefix_cache
+from src.ai.prompt import prompt_context
+from src.ai.inference import inference_config, DTYPES
+from src.ai.precompiled import precompiled
+from src.ai.compiler import compile_script, prefetch_script
+from src.ai import generate_code
+from src.ai.generate_code import think_code_batch, set_token_budget
+from src.ai.pipeline import think_pipeline
+from src.ai import daemon, streaming
+from src.ai.daemon import ThinkDaemon
+from src.ai.backends import make_backends, BACKENDS
+from src.ai.memo import think_memo
+from src.ai.async_pool import think_pool
+from src.ai.stats import think_stats
+from src.consts import THINK_POLICIES
 import os
 import sys
+import atexit
 
 from rich.console import Console
 
 console = Console()
 
+FLAGS = (
+    "--no-ai",
+    "--preload",
+    "--persist-kv",
+    "--unconstrained",
+    "--retrieve",
+    "--quantize",
+    "--torch-compile",
+    "--no-daemon",
+    "--offline",
+    "--stream",
+)
+VALUE_FLAGS = (
+    "--max-tokens=",
+    "--candidates=",
+    "--attempts=",
+    "--prompt-lookup=",
+    "--dtype=",
+    "--threads=",
+    "--backend=",
+    "--fake-delay=",
+    "--think-memo=",
+    "--async-workers=",
+    "--model-dir=",
+    "--think-stats=",
+)
+
+
+def handle_flags(args):
+    backend, fake_delay = None, 0.0
+    for arg in args:
+        if arg.startswith("--max-tokens="):
+            set_token_budget(int(arg.split("=", 1)[1]))
+        elif arg.startswith("--candidates="):
+            generate_code.candidates = int(arg.split("=", 1)[1])
+        elif arg.startswith("--attempts="):
+            generate_code.max_attempts = int(arg.split("=", 1)[1])
+        elif arg.startswith("--prompt-lookup="):
+            generate_code.prompt_lookup_tokens = int(arg.split("=", 1)[1])
+        elif arg.startswith("--dtype="):
+            dtype = arg.split("=", 1)[1]
+            if dtype not in DTYPES:
+                console.print(
+                    f"Unknown dtype '{dtype}', expected one of {', '.join(DTYPES)}",
+                    style="bold red",
+                )
+                exit(1)
+            inference_config.dtype = dtype
+        elif arg.startswith("--threads="):
+            inference_config.threads = int(arg.split("=", 1)[1])
+        elif arg.startswith("--backend="):
+            backend = arg.split("=", 1)[1]
+            if backend not in BACKENDS:
+                console.print(
+                    f"Unknown backend '{backend}', expected one of {', '.join(BACKENDS)}",
+                    style="bold red",
+                )
+                exit(1)
+        elif arg.startswith("--fake-delay="):
+            fake_delay = float(arg.split("=", 1)[1])
+        elif arg.startswith("--think-memo="):
+            policy = arg.split("=", 1)[1]
+            if policy not in THINK_POLICIES:
+                console.print(
+                    f"Unknown think policy '{policy}', expected one of {', '.join(THINK_POLICIES)}",
+                    style="bold red",
+                )
+                exit(1)
+            think_memo.default_policy = policy
+        elif arg.startswith("--async-workers="):
+            think_pool.max_workers = int(arg.split("=", 1)[1])
+        elif arg.startswith("--model-dir="):
+            brain.models_dir = os.path.abspath(arg.split("=", 1)[1])
+        elif arg.startswith("--think-stats="):
+            atexit.register(think_stats.dump, arg.split("=", 1)[1])
+    if backend is not None:
+        generate_code.backends = make_backends(backend, fake_delay)
+    args = [arg for arg in args if not arg.startswith(VALUE_FLAGS)]
+
+    if "--persist-kv" in args:
+        prefix_cache.persist = True
+    if "--unconstrained" in args:
+        generate_code.constrain_to_lexer = False
+    if "--retrieve" in args:
+        prompt_context.enable_retrieval()
+    if "--quantize" in args:
+        inference_config.quantize = True
+    if "--torch-compile" in args:
+        inference_config.compile = True
+    if "--offline" in args:
+        brain.offline = True
+    if "--stream" in args:
+        streaming.enabled = True
+    if "--no-daemon" in args:
+        daemon.use_daemon = False
+    if "--no-ai" in args:
+        brain.disable()
+    elif "--preload" in args:
+        preload()
+    return [arg for arg in args if arg not in FLAGS]
+
+
+def read_source(path):
+    fname = os.path.split(path)[0]
+    if not os.path.exists(path):
+        console.print(f"File '{fname}' does not exist", style="bold red")
+        exit(1)
+    with open(path, "r") as f:
+        return [line for line in f.readlines() if line.strip()]
+
 
 def handle_commands(args):
     if args[0] == "-h" or args[0] == "--help":
-        console.print(f"Usage: {sys.argv[0]} [file]")
+        console.print(
+            f"Usage: {sys.argv[0]} [--no-ai | --preload] [--persist-kv] [--max-tokens=N] [--candidates=K] [--attempts=N] [--prompt-lookup=N] [--dtype=fp32|bf16] [--quantize] [--threads=N] [--torch-compile] [--unconstrained] [--retrieve] [--no-daemon] [--backend=NAME] [--fake-delay=S] [--think-memo=POLICY] [--async-workers=N] [--model-dir=DIR] [--offline] [--stream] [--think-stats=FILE] [--serve | --convert-model | --compile] [file]"
+        )
         console.print(
             "If no file is specified, the interpreter will run in interactive mode."
         )
+        console.print("  --no-ai    never load the model, 'think' becomes an error")
+        console.print(
+            "  --preload  load the model at startup instead of on first 'think'"
+        )
+        console.print(
+            "  --persist-kv  keep the prefilled syntax preamble on disk between runs (1 GB at most)"
+        )
+        console.print(
+            "  --max-tokens=N  most tokens a single think may generate (default 512)"
+        )
+        console.print(
+            "  --candidates=K  sample K codes per retry and run the first that parses"
+        )
+        console.print(
+            "  --attempts=N  most generate calls per think before giving up (default 3)"
+        )
+        console.print(
+            "  --prompt-lookup=N  draft N tokens from the prompt per decode step, 0 is off (default 10)"
+        )
+        console.print("  --dtype=fp32|bf16  dtype the model runs in (default bf16)")
+        console.print("  --quantize  quantize the linear layers to int8, runs in fp32")
+        console.print("  --threads=N  threads torch may use for inference")
+        console.print(
+            "  --torch-compile  compile the model, slow start but faster decode"
+        )
+        console.print("  --unconstrained  let the model write code that does not lex")
+        console.print(
+            "  --retrieve  only send the examples most relevant to each prompt"
+        )
+        console.print("  --no-daemon  never hand thinks to a running model daemon")
+        console.print(
+            f"  --backend=NAME  where think code comes from: {', '.join(BACKENDS)} (default auto, the daemon if one runs and else the model)"
+        )
+        console.print(
+            "  --fake-delay=S  seconds the fake backend takes per generation, it never loads a model"
+        )
+        console.print(
+            "  --think-memo=once|distinct|always  when a think generates again, unless it says otherwise (default distinct, once per prompt)"
+        )
+        console.print(
+            "  --async-workers=N  thinks from think_async that may generate at once (default 4)"
+        )
+        console.print(
+            "  --model-dir=DIR  where models are downloaded to and converted in (default ~/.cache/thinklang/models)"
+        )
+        console.print("  --offline  never download a model, only use what is on disk")
+        console.print(
+            "  --stream  run each statement of generated code as soon as it is written"
+        )
+        console.print(
+            "  --think-stats=FILE  write what every think cost to a JSON file at exit"
+        )
+        console.print(
+            "  --serve  keep the model loaded and generate for every other think.py run"
+        )
+        console.print(
+            "  --convert-model  save the model in the dtype it runs in, for faster loads"
+        )
+        console.print(
+            "  --compile  generate every constant think prompt into a <file>.json sidecar"
+        )
+    elif args[0] == "--compile":
+        path = str(args[1].replace("\\", "/"))
+        sidecar, invalid, err = compile_script(path, read_source(path))
+        if err:
+            console.print(err, style="bold red")
+            exit(1)
+        for prompt, reason in invalid.items():
+            console.print(
+                f"Left out think '{prompt}', it generates at runtime: {reason}",
+                style="yellow",
+            )
+        console.print(f"Wrote {sidecar}", style="green")
+    elif args[0] == "--convert-model":
+        console.print(f"Wrote {brain.convert()}", style="green")
+    elif args[0] == "--serve":
+        server = ThinkDaemon()
+        preload()
+        console.print(f"Serving thinks on {server.path}", style="green")
+        try:
+            server.serve()
+        except OSError as e:
+            console.print(str(e), style="bold red")
+            exit(1)
+        except KeyboardInterrupt:
+            pass
     else:
         path = str(args[0].replace("\\", "/"))
         fname = os.path.split(path)[0]
-        if os.path.exists(path):
-            with open(path, "r") as f:
-                source_code = [line for line in f.readlines() if line.strip()]
-        else:
-            console.print(f"File '{fname}' does not exist", style="bold red")
-            exit(1)
-        for code in source_code:
-            result, err = run(fname, code)
+        source_code = read_source(path)
+        # think bodies compiled ahead of time replace calls to the model
+        rejected = precompiled.load(path)
+        if rejected:
+            console.print(rejected, style="yellow")
+        # a streamed think writes its own code, prefetching it would hand it over whole
+        if brain.enabled and not streaming.enabled:
+            # generation overlaps with running the statements before each think
+            think_pipeline.start(think_code_batch, generate_code.batch_size)
+            prefetch_script(path, source_code)
+        for result, err in run_script(fname, source_code):
             if err:
                 console.print(err, style="bold red")
 
 
 if __name__ == "__main__":
-    args = sys.argv[1:]
+    args = handle_flags(sys.argv[1:])
     if len(args) > 0:
         handle_commands(args)
         exit(0)
@@ -41,6 +259,8 @@ if __name__ == "__main__":
     console.print(f"ThinkLang Shell {VERSION} - Python {sys.version.split('(')[0]}")
     console.print("-" * 35, style="bold blue")
     console.print("Type 'help()' for a list of commands", style="white")
+    if brain.enabled and not streaming.enabled:
+        think_pipeline.start(think_code_batch, generate_code.batch_size)
     while True:
         text = console.input(prompt="ThinkLang >> ")
         result, err = run("<stdin>", text)